@@ -0,0 +1,92 @@
+import os
+import sys
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", ".."))
+from common import constants as tc
+from common.lane_index import LaneIndex
+
+# The simulation side of the experiment: what a worker needs to run a policy, and nothing of the analysis, so the
+# workers import neither pandas nor the recorder (utils re-exports all of it for the analysis and the recordings)
+
+# Vehicle variables needed to index every lane each step, delivered in one subscription response (type comes from
+# the registry)
+STATE_VARS = (tc.VAR_LANE_ID, tc.VAR_LANEPOSITION, tc.VAR_LENGTH, tc.VAR_MINGAP)
+
+SIM_DURATION = 86400
+EMERGENCY_PROB = 0.003
+# the sweep of simulation_run.py, also the runs of the recordings: one run per combination of the grid, see
+# common/experiment.py
+SPEC = {
+    "name": "emergency_flow{flow}_av{av_prob}_emer{emergency_prob}",
+    "net_file": "../emergency.net.xml",
+    "route_template": "../emergency.rou.xml",
+    "options": {"junction-taz": "true"},
+    "grid": {"flow": [1000, 2000, 3000, 4000, 5000, 6000, 7000, 8000, 9000, 10000],
+             "av_prob": [0.0, 0.1, 0.2, 0.3, 0.4, 0.5, 0.6, 0.7, 0.8, 0.9, 1.0],
+             "emergency_prob": [EMERGENCY_PROB],
+             "seed": [6242],
+             "duration": [SIM_DURATION]},
+}
+# with ADAPTIVE_REPS, simulation_run.py records the reps of every (policy, run) here, for the pairwise analysis
+REPLICATION_FILE = "results_reps_long/replication.json"
+
+
+class Rule:
+    # a lane-clearing rule: every vehicle of vTypes (None: any but an emergency vehicle) up to max_dist ahead of an
+    # emergency vehicle, on its lane, moves to the other side of the road
+    def __init__(self, max_dist=float("inf"), vTypes=None):
+        self.max_dist = max_dist
+        self.vTypes = vTypes
+
+    def applies(self, vType, distance):
+        if distance >= self.max_dist:
+            return False
+        return vType != "emergency" if self.vTypes is None else vType in self.vTypes
+
+
+POLICY_RULES = {
+    "Nothing": (),
+    "ClearFront": (Rule(vTypes={"AV"}),),
+    "ClearFront500": (Rule(500, {"AV"}),),
+    "HD50": (Rule(50),),
+    "ClearFront_HD50": (Rule(vTypes={"AV"}), Rule(50)),
+    "ClearFront500_HD50": (Rule(500, {"AV"}), Rule(50)),
+}
+
+
+def handle_step(t, policy_name, registry):
+    registry.update()
+    states = registry.snapshot()
+    rules = POLICY_RULES[policy_name]
+    emergencies = [vehID for vehID, state in states.items() if state[0] == "emergency"]
+    if not rules or not emergencies:
+        return False
+    # one pass over the lanes of the emergency vehicles, as far as the widest rule reaches, for all rules at once;
+    # a vehicle ahead of several emergency vehicles is visited once, and told once even if several rules apply
+    lane_index = LaneIndex(states)
+    for lane, vehID, vType, distance in lane_index.ahead_of(emergencies, max(rule.max_dist for rule in rules)):
+        if any(rule.applies(vType, distance) for rule in rules):
+            registry.commands.change_lane(vehID, 1 if lane.endswith("2") else 0, 1)
+    registry.commands.flush()
+    return True
+
+
+def configure_routes(routes, params):
+    # experiment.expand hook: set the MajorFlow rate, the vehicle mix and the duration of one run on the parsed route
+    # template. An AV share that leaves no room for the emergency vehicles is capped, as in the old rou files.
+    av_prob, emergency_prob = params["av_prob"], params["emergency_prob"]
+    if av_prob + emergency_prob > 1:
+        av_prob = 1 - emergency_prob
+
+    for flow in routes.findall('flow'):
+        if flow.get('id') == 'MajorFlow':
+            flow.set('vehsPerHour', str(params["flow"]))
+        flow.set('end', str(params["duration"]))
+
+    for vtype in routes.find("vTypeDistribution").findall('vType'):
+        if vtype.get('id') == 'emergency':
+            vtype.set('probability', str(emergency_prob))
+        elif vtype.get('id') == 'AV':
+            vtype.set('probability', str(av_prob))
+        elif vtype.get('id') == 'HD':
+            vtype.set('probability', str(1 - av_prob - emergency_prob))
+    return dict(params, av_prob=av_prob)
@@ -0,0 +1,70 @@
+import os
+import pandas as pd
+import pyarrow as pa
+import pyarrow.dataset as ds
+
+STORE_DIR = "results_store"
+# The analysis results of all sweeps, as one Parquet dataset per kind of result, one row per (partition values, keys)
+# with a column per stat (avg_<metric>, std_<metric>, count). Only the few values of the partition columns make
+# directories (reps=1/policy=HD50/...), the keys are ordinary columns: a query reads the files of the partitions it
+# selects and filters their rows, and writing a slice rewrites only its own partitions, keeping their other rows.
+#   stats: the per-policy stats of parse_output_files
+#   pairwise: the diffs of a policy against a baseline policy, trip by trip, of pairwise_stats
+# reps is the number of reps per run (1 for the long runs)
+COLUMN_TYPES = {"reps": pa.int64(), "baseline": pa.string(), "policy": pa.string(), "flow": pa.int64(),
+                "av_rate": pa.float64(), "vType": pa.string()}
+PARTITIONS = {
+    "stats": ["reps", "policy"],
+    "pairwise": ["reps", "baseline", "policy"],
+}
+KEYS = ["flow", "av_rate", "vType"]
+
+
+class ResultStore:
+    def __init__(self, root=STORE_DIR):
+        self.root = root
+
+    def path(self, dataset):
+        return os.path.join(self.root, dataset)
+
+    def partitioning(self, dataset):
+        return ds.partitioning(pa.schema([(col, COLUMN_TYPES[col]) for col in PARTITIONS[dataset]]), flavor="hive")
+
+    def write(self, dataset, df):
+        # df: one row per (partition values, keys), given as columns or index levels, with the stats. Rows of the
+        # same partitions and keys are replaced, the other rows of these partitions are kept.
+        columns = PARTITIONS[dataset] + KEYS
+        df = df.reset_index() if any(name in columns for name in df.index.names) else df
+        df = df.astype({col: COLUMN_TYPES[col].to_pandas_dtype() for col in columns})
+        if os.path.exists(self.path(dataset)):
+            existing = self.query(dataset, **{col: df[col].unique().tolist() for col in PARTITIONS[dataset]})
+            existing = existing.astype({col: COLUMN_TYPES[col].to_pandas_dtype() for col in columns})
+            replaced = existing.merge(df[columns].drop_duplicates(), on=columns, how="left", indicator=True)
+            df = pd.concat([existing[(replaced["_merge"] == "left_only").to_numpy()], df], ignore_index=True)
+        df.to_parquet(self.path(dataset), partition_cols=PARTITIONS[dataset], index=False,
+                      existing_data_behavior="delete_matching")
+
+    def query(self, dataset, columns=None, **filters):
+        # The rows of the partitions matching every filter, e.g. query("pairwise", reps=1, flow=[6000, 7000]): a value
+        # selects one partition value, a list any of them. columns restricts the stat columns read.
+        filters = [(col, "in", list(values) if isinstance(values, (list, tuple, set)) else [values])
+                   for col, values in filters.items()]
+        if columns is not None:
+            columns = PARTITIONS[dataset] + KEYS + [col for col in columns if col not in PARTITIONS[dataset] + KEYS]
+        return pd.read_parquet(self.path(dataset), columns=columns, filters=filters or None,
+                               partitioning=self.partitioning(dataset))
+
+    def table(self, dataset, index, columns=("vType",), **filters):
+        # a query pivoted to index x (columns, stat), e.g. table("pairwise", "av_rate", reps=1, policy="HD50",
+        # flow=6000) gives the layout of the former per-(policy, flow) csvs, and index="flow" their per-AV-rate view
+        index, columns = [index] if isinstance(index, str) else list(index), list(columns)
+        df = self.query(dataset, **filters)
+        # the partition columns and keys neither in the index nor in the columns must be fixed by the filters
+        rest = [col for col in PARTITIONS[dataset] + KEYS if col not in index + columns]
+        ambiguous = [col for col in rest if df[col].nunique() > 1]
+        if ambiguous:
+            raise ValueError(f"several values of {ambiguous} in the selection, filter them or add them to the index")
+        table = df.drop(columns=rest).set_index(index + columns).unstack(columns)
+        table = table.reorder_levels(list(range(1, len(columns) + 1)) + [0], axis=1)
+        table.columns.names = columns + ["stat"]
+        return table.sort_index()
@@ -1,26 +1,75 @@
 import os
 import sys
+import time
+import traceback
+import multiprocessing
 import numpy as np
-import pandas as pd
-
-
-
-from tqdm import tqdm
-from multiprocessing import Pool
-from utils import *
-import traci
+from multiprocessing import Pool, Process
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", ".."))
+# the workers import this module, and only the simulation side of the experiment: pandas, tqdm and the analysis in
+# utils are imported where the coordinator uses them
+from controller import STATE_VARS, SPEC, REPLICATION_FILE, handle_step, configure_routes
+from common.backend import traci
+from common.registry import VehicleRegistry
+from common.scheduler import CostModel
+from common.manifest import RunManifest
+from common.files import file_checksum, tmp_name, write_json_atomic
+from common.warmup import SAVE_STATE_OPTIONS, save_warmup, fork_from
+from common.experiment import expand
+from common.profiling import Profiler
+from common.replication import AdaptiveReplication
+from common.work_queue import WorkQueue, POLL_SECONDS
+from common.driver import drive_pool, run_connections
+from tripinfo import prepend_trips, trips_file_name, load_tripinfo
+from trip_metrics import TripCollector, TRIP_VARS
 
 GUI = False
+# simulator backend: "traci" (socket), "libsumo" (in-process, no GUI) or "fake" (pure Python, no SUMO needed)
+BACKEND = os.environ.get("SIM_BACKEND", "traci")
+# SIM_PROFILE=1 writes a profile of the TraCI calls and step phases of every run next to its tripinfo output
+PROFILE = os.environ.get("SIM_PROFILE", "0") == "1"
+# SIM_QUEUE=<directory on a filesystem shared by the nodes> runs the sweep on several nodes: this process queues the
+# tasks and collects the results, and "python simulation_run.py worker [processes]" started on every node (in the
+# same shared directory as this one) runs them, see common/work_queue.py
+QUEUE_DIR = os.environ.get("SIM_QUEUE")
+# SIM_START_METHOD=forkserver starts the worker processes from a server that imported this module once, before the
+# coordinator imported the analysis, so every worker forks from a process holding only the simulation modules.
+# "spawn" starts each worker from a fresh interpreter, unset keeps the platform's default (fork on Linux)
+START_METHOD = os.environ.get("SIM_START_METHOD")
 
 # SIM parameters
-SIM_DURATION = 86400
 NUM_PROCESSES = 70
+# SUMO runs each worker process drives at once, from one thread each (see common/driver.py): while a run waits for its
+# SUMO to compute a step, the others run their handle_step, so fewer Python processes keep the SUMO cores busy. Needs
+# the traci or fake backend (libsumo runs one simulation per process)
+CONNECTIONS_PER_WORKER = 1
 NUM_REPS = 1
-EMERGENCY_PROB = 0.003
 POLICIES = ["ClearFront500", "ClearFront500_HD50","ClearFront","HD50","ClearFront_HD50","Nothing"]
+MANIFEST_FILE = "results_reps_long/manifest.json"
+# simulate each cfg up to its first emergency vehicle once, and run the policies from that saved state. Pays off when
+# the first emergency vehicle comes late; SUMO does not restore the insertion queue exactly, so forked runs match
+# full runs statistically, not vehicle by vehicle
+SHARED_WARMUP = False
+# accumulate the trip metrics per vType during the run instead of having SUMO write tripinfo XML: each run writes a
+# .summary.json (the calc_stats table) and, with KEEP_TRIPS, the per-vehicle metrics the pairwise diffs need
+ONLINE_METRICS = False
+KEEP_TRIPS = True
+# run more seeds of every (policy, flow, AV share), REP_BATCH at a time, until the confidence interval of the mean
+# per-seed diff of CI_METRIC for the CI_VTYPE vehicles against BASELINE is narrower than CI_WIDTH percent points (or
+# MAX_REPS seeds). The sweep spends at most REP_BUDGET seeds per cell on average, the noisiest cells first
+ADAPTIVE_REPS = False
+BASELINE = "Nothing"
+CI_VTYPE = "emergency"
+CI_METRIC = "totalDelay"
+CI_WIDTH = 5.0
+REP_BATCH = 2
+MAX_REPS = 10
+REP_BUDGET = 4
 
 # Traffic parameters
 AV_PROB = None  # testing many AV probabilities
+# the sweep itself (SPEC, with its duration and emergency share) is declared in controller.py, shared with the
+# recordings of utils.py
 
 if 'SUMO_HOME' in os.environ:
     sumo_path = os.environ['SUMO_HOME']
@@ -32,37 +81,290 @@ if 'SUMO_HOME' in os.environ:
     else:
         sumoBinary = os.path.join(sumo_path, 'bin', 'sumo-gui') if GUI else \
             os.path.join(sumo_path, 'bin', 'sumo')
+elif BACKEND == "fake":
+    sumoBinary = "sumo"
 else:
     sys.exit("please declare environment variable 'SUMO_HOME'")
+traci.use(BACKEND)
+
+
+def set_start_method():
+    # before the first worker process is started
+    if START_METHOD is None:
+        return
+    multiprocessing.set_start_method(START_METHOD, force=True)
+    if START_METHOD == "forkserver":
+        multiprocessing.set_forkserver_preload(["__main__"])
+
+
+def output_file_name(policy_name, run):
+    return "results_reps_long/"+policy_name+"_"+run.name+".xml"
+
+
+def simulate(arg, warmup=None):
+    # warmup: (fork step, state file, tripinfo of the warm-up) to continue from, see simulate_forked
+    policy_name, run = arg
+    exp_output_name = output_file_name(policy_name, run)
+    # SUMO writes to a temporary name, the output only gets its final name once the run is complete. The name is
+    # unique per host, process and thread, as a task requeued from a slow worker may run twice at once
+    partial_output_name = tmp_name(exp_output_name[:-len(".xml")], ".part.xml")
+    sumoCmd = [sumoBinary] + run.sumo_args()
+    if ONLINE_METRICS:
+        collector = TripCollector(KEEP_TRIPS)
+        registry = VehicleRegistry(STATE_VARS, TRIP_VARS)
+    else:
+        sumoCmd += ["--tripinfo-output", partial_output_name]
+        registry = VehicleRegistry(STATE_VARS)
 
+    profiler = Profiler(PROFILE)
+    with profiler.attached():
+        traci.start(sumoCmd)
+        step = 0
+        if warmup is not None:
+            step, state_file, _ = warmup
+            fork_from(state_file, registry)
+        while traci.simulation.getMinExpectedNumber() > 0:
+            with profiler.phase("handle_step"):
+                handle_step(step, policy_name, registry)
+            if ONLINE_METRICS:
+                collector.collect(registry)
+            with profiler.phase("simulationStep"):
+                traci.simulationStep(step)
+            profiler.end_step()
+            step += 1
+        if ONLINE_METRICS:
+            collector.finish(registry)
+        traci.close()
+    if profiler.enabled:
+        profiler.write(exp_output_name[:-len(".xml")] + ".profile.json")
+    if ONLINE_METRICS:
+        # the trips file is the run's output when there is one, the summary otherwise
+        summary_file = exp_output_name[:-len(".xml")] + ".summary.json"
+        trips_file = trips_file_name(exp_output_name) if KEEP_TRIPS else None
+        collector.write(summary_file, trips_file)
+        return trips_file or summary_file
+    if warmup is not None:
+        prepend_trips(warmup[2], partial_output_name)
+    os.replace(partial_output_name, exp_output_name)
+    return exp_output_name
 
-def simulate(arg):
-    policy_name, sumoCfg = arg
-    sumoCmd = [sumoBinary, "-c", sumoCfg, "--tripinfo-output"]
-    exp_output_name = "results_reps_long/"+policy_name+"_"+".".join(sumoCfg.split("/")[-1].split(".")[:-1])+".xml"
 
-    sumoCmd.append(exp_output_name)
-    traci.start(sumoCmd)
-    step = 0
-    while traci.simulation.getMinExpectedNumber() > 0:
-        handle_step(step, policy_name)
-        traci.simulationStep(step)
-        step += 1
+def simulate_forked(arg):
+    # No policy acts before an emergency vehicle is on the road, so that prefix is simulated once (as "Nothing") and
+    # saved, and every policy in arg continues from it: same vehicles, same random state at the fork.
+    policy_names, run = arg
+    warmup_name = output_file_name("warmup", run)[:-len(".xml")]
+    prefix_output_name, state_file = tmp_name(warmup_name, ".part.xml"), tmp_name(warmup_name, ".state.xml.gz")
+    traci.start([sumoBinary] + run.sumo_args() + ["--tripinfo-output", prefix_output_name] + SAVE_STATE_OPTIONS)
+    registry = VehicleRegistry()
+
+    def emergency_on_road(step):
+        registry.update()
+        return "emergency" in registry.types.values()
+
+    fork_step = save_warmup(state_file, emergency_on_road)
     traci.close()
+    outputs = [simulate((policy_name, run), (fork_step, state_file, prefix_output_name))
+               for policy_name in policy_names]
+    os.remove(state_file)
+    os.remove(prefix_output_name)
+    return outputs
+
+
+def run_task(arg):
+    # simulate, reporting the runtime and output checksum, or the error instead of raising it in the pool.
+    # A task of several policies (SHARED_WARMUP) reports one result per policy, sharing the runtime among them.
+    start = time.perf_counter()
+    policy_names, run = arg
+    forked = not isinstance(policy_names, str)
+    try:
+        outputs = simulate_forked(arg) if forked else [simulate(arg)]
+    except Exception:
+        try:
+            traci.close()
+        except Exception:
+            pass
+        error = traceback.format_exc()
+        seconds = time.perf_counter() - start
+        return [{"arg": sub_arg, "error": error, "seconds": seconds} for sub_arg in split_task(arg)]
+    seconds = (time.perf_counter() - start) / len(outputs)
+    return [{"arg": sub_arg, "output": output, "checksum": file_checksum(output), "seconds": seconds}
+            for sub_arg, output in zip(split_task(arg), outputs)]
+
+
+def split_task(arg):
+    # the (policy, run) pairs of a task
+    policy_names, run = arg
+    if isinstance(policy_names, str):
+        return [arg]
+    return [(policy_name, run) for policy_name in policy_names]
+
+
+def group_by_run(args):
+    # one task per run with all its policies, in the order of the runs' longest policies
+    policies = {}
+    runs = {}
+    for policy_name, run in args:
+        policies.setdefault(run.key, []).append(policy_name)
+        runs[run.key] = run
+    return [(tuple(policy_names), runs[key]) for key, policy_names in policies.items()]
+
+
+def task_key(arg):
+    policy_name, run = arg
+    return f"{policy_name}_{run.name}"
+
+
+def task_params(arg):
+    policy_name, run = arg
+    return dict(task_features(arg), run=run.key, seed=run.params.get("seed"), backend=BACKEND,
+                shared_warmup=SHARED_WARMUP, online_metrics=ONLINE_METRICS)
+
+
+def task_features(arg):
+    policy_name, run = arg
+    return {"policy": policy_name, "flow": float(run.params["flow"]), "av_prob": float(run.params["av_prob"]),
+            "duration": run.params["duration"]}
 
 
 def parallel_simulation(args):
+    if SHARED_WARMUP and ONLINE_METRICS:
+        raise ValueError("SHARED_WARMUP merges the warm-up into tripinfo output, it cannot be used with ONLINE_METRICS")
+    if CONNECTIONS_PER_WORKER > 1 and BACKEND == "libsumo":
+        raise ValueError("libsumo runs one simulation per process, CONNECTIONS_PER_WORKER needs the traci backend")
+    # skip the runs the manifest records as complete, retry the failed and partial ones
+    os.makedirs(os.path.dirname(MANIFEST_FILE), exist_ok=True)
+    manifest = RunManifest(MANIFEST_FILE)
+    todo = [arg for arg in args if not manifest.is_done(task_key(arg), task_params(arg))]
+    if len(todo) < len(args):
+        print(f"skipping {len(args) - len(todo)} completed runs")
+    manifest.mark_pending({task_key(arg): task_params(arg) for arg in todo})
+    # longest tasks first, one task per dispatch, and the actual runtimes feed the estimates of the next sweep
+    cost_model = CostModel()
+    todo = cost_model.order(todo, task_key, task_features)
+    if SHARED_WARMUP:
+        todo = group_by_run(todo)
+    for results in (coordinate(todo) if QUEUE_DIR is not None else run_pool(todo)):
+        for result in results:
+            key = task_key(result["arg"])
+            if "error" in result:
+                print(f"{key} failed:\n{result['error']}")
+                manifest.mark_failed(key, result["error"])
+                continue
+            manifest.mark_done(key, result["output"], result["checksum"], result["seconds"])
+            cost_model.record(key, result["seconds"], **task_features(result["arg"]))
+
+
+def run_pool(todo):
+    from tqdm import tqdm
+    if CONNECTIONS_PER_WORKER > 1:
+        yield from tqdm(drive_pool(run_task, todo, NUM_PROCESSES, CONNECTIONS_PER_WORKER), total=len(todo))
+        return
     with Pool(NUM_PROCESSES) as pool:  # 10 processes
-        results = list(tqdm(pool.imap(simulate, args), total=len(args)))
+        yield from tqdm(pool.imap_unordered(run_task, todo), total=len(todo))
+
+
+def coordinate(todo):
+    # the results of the tasks as the workers of the queue report them; the tasks of dead workers are run again
+    from tqdm import tqdm
+    queue = WorkQueue(QUEUE_DIR)
+    remaining = set(queue.put(todo, lambda arg: task_key(split_task(arg)[0])))
+    requeued = set()
+    with tqdm(total=len(remaining)) as progress:
+        while remaining:
+            for file_name, results in queue.collect():
+                # a task requeued from a worker that was only slow may run twice, both runs renaming their output to
+                # the same name: the first report whose outputs are the final files counts, the others are dropped
+                if file_name not in remaining:
+                    continue
+                if file_name in requeued and any(file_checksum(result["output"]) != result["checksum"]
+                                                 for result in results if "error" not in result):
+                    continue
+                remaining.remove(file_name)
+                progress.update()
+                yield results
+            for file_name in queue.requeue_stale():
+                requeued.add(file_name)
+                print(f"requeued {file_name}, its worker stopped responding")
+            if remaining:
+                time.sleep(POLL_SECONDS)
+    queue.close()
 
 
-if __name__ == "__main__":
-    sumoCfgPaths = []
-    for sumoCfg in os.listdir("../cfg_files_large"):
-        if sumoCfg.endswith(".sumocfg"):
-            sumoCfgPath = f"../cfg_files_large/{sumoCfg}"
-            sumoCfgPaths.append(sumoCfgPath)
+def work(queue_dir):
+    queue = WorkQueue(queue_dir)
+    if CONNECTIONS_PER_WORKER > 1:
+        run_connections(lambda: queue.work(run_task), CONNECTIONS_PER_WORKER)
+    else:
+        queue.work(run_task)
+
+
+def rep_run(spec, run, rep):
+    # rep 0 is the run of the sweep, rep r the same traffic with seed + r
+    if rep == 0:
+        return run
+    grid = {param: [value] for param, value in run.params.items()}
+    grid["seed"] = [run.params["seed"] + rep]
+    return expand(dict(spec, name=spec["name"] + f"_rep{rep}", grid=grid), configure_routes)[0]
+
+
+def rep_diff(policy_name, run):
+    # mean diff (%) of CI_METRIC of the CI_VTYPE trips of a run under policy_name against the same run under BASELINE
+    from utils import pairwise_diffs
+    diffs = pairwise_diffs(load_tripinfo(output_file_name(policy_name, run)).assign(policy=policy_name),
+                           load_tripinfo(output_file_name(BASELINE, run)))
+    if CI_VTYPE != "all":
+        diffs = diffs[diffs.vType == CI_VTYPE]
+    return float(diffs[f"{CI_METRIC}_diff"].mean())
 
-    args = [(policy_name, sumoCfgPath) for policy_name in POLICIES for sumoCfgPath in sumoCfgPaths]
-    parallel_simulation(args)
-    parse_all_pairwise()
\ No newline at end of file
+
+def adaptive_simulation(spec, runs, policy_names):
+    # the reps of a cell are paired: rep r of the policy and of BASELINE share their seed, and BASELINE runs once
+    # for all policies
+    if ONLINE_METRICS and not KEEP_TRIPS:
+        raise ValueError("ADAPTIVE_REPS compares the runs trip by trip, ONLINE_METRICS needs KEEP_TRIPS")
+    runs = {run.name: run for run in runs}
+    cells = [(policy_name, name) for policy_name in policy_names if policy_name != BASELINE for name in runs]
+    replication = AdaptiveReplication(cells, CI_WIDTH, batch=REP_BATCH, max_reps=MAX_REPS,
+                                      budget=REP_BUDGET * len(cells))
+    # the runs of the reps that count towards each cell, which the pairwise analysis pools
+    rep_runs = {cell: [] for cell in cells}
+    while batch := replication.next_batch():
+        reps = [(cell, rep_run(spec, runs[cell[1]], rep)) for cell, cell_reps in batch.items() for rep in cell_reps]
+        args = {task_key(arg): arg for (policy_name, _), run in reps for arg in [(policy_name, run), (BASELINE, run)]}
+        parallel_simulation(list(args.values()))
+        manifest = RunManifest(MANIFEST_FILE)
+        for (policy_name, name), run in reps:
+            # a failed rep counts against the budget but not towards the interval
+            if all(manifest.is_done(task_key(arg), task_params(arg)) for arg in [(policy_name, run), (BASELINE, run)]):
+                diff = rep_diff(policy_name, run)
+                if not np.isnan(diff):
+                    replication.add((policy_name, name), diff)
+                    rep_runs[(policy_name, name)].append(run.name)
+        print(f"{replication.spent()} reps run, {sum(map(replication.done, cells))}/{len(cells)} cells done")
+    write_json_atomic(REPLICATION_FILE, [dict(policy=policy_name, run=name, rep_runs=rep_runs[(policy_name, name)],
+                                              **replication.stats((policy_name, name))) for policy_name, name in cells])
+    return replication
+
+
+if __name__ == "__main__" and sys.argv[1:2] == ["worker"]:
+    # a node's workers, CONNECTIONS_PER_WORKER SUMO runs each at a time, until the coordinator is done with the queue
+    if QUEUE_DIR is None:
+        sys.exit("please declare environment variable 'SIM_QUEUE'")
+    set_start_method()
+    workers = [Process(target=work, args=(QUEUE_DIR,))
+               for _ in range(int(sys.argv[2]) if len(sys.argv) > 2 else NUM_PROCESSES)]
+    for worker in workers:
+        worker.start()
+    for worker in workers:
+        worker.join()
+elif __name__ == "__main__":
+    set_start_method()
+    runs = expand(SPEC, configure_routes)
+    if ADAPTIVE_REPS:
+        adaptive_simulation(SPEC, runs, POLICIES)
+    else:
+        args = [(policy_name, run) for policy_name in POLICIES for run in runs]
+        parallel_simulation(args)
+    from utils import parse_all_pairwise
+    parse_all_pairwise()
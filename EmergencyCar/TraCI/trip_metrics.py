@@ -0,0 +1,99 @@
+import math
+import numpy as np
+
+from common.backend import traci
+from common import constants as tc
+from common.files import write_json_atomic
+from tripinfo import COLUMNS, save_cached
+
+# metrics of a trip, as in calc_stats (speed = routeLength / duration, totalDelay = departDelay + timeLoss)
+METRICS = ["duration", "departDelay", "speed", "timeLoss", "totalDelay"]
+# what a trip is computed from: the last subscription results of the vehicle before it arrived
+TRIP_VARS = (tc.VAR_DEPARTURE, tc.VAR_DEPART_DELAY, tc.VAR_TIMELOSS, tc.VAR_DISTANCE, tc.VAR_LANE_ID,
+             tc.VAR_LANEPOSITION)
+
+
+class RunningStats:
+    # Welford's running mean and variance of each metric
+    def __init__(self):
+        self.count = 0
+        self.mean = [0.] * len(METRICS)
+        self.m2 = [0.] * len(METRICS)
+
+    def add(self, values):
+        self.count += 1
+        for i, value in enumerate(values):
+            delta = value - self.mean[i]
+            self.mean[i] += delta / self.count
+            self.m2[i] += delta * (value - self.mean[i])
+
+    def stats(self):
+        # same names as calc_stats; std with ddof=1
+        stats = {}
+        for i, metric in enumerate(METRICS):
+            stats[f"avg_{metric}"] = self.mean[i] if self.count else math.nan
+        for i, metric in enumerate(METRICS):
+            stats[f"std_{metric}"] = math.sqrt(self.m2[i] / (self.count - 1)) if self.count > 1 else math.nan
+        stats["count"] = self.count
+        return stats
+
+
+class TripCollector:
+    # Trip metrics per vType, accumulated while the simulation runs instead of read back from SUMO's tripinfo
+    # output. The registry must subscribe TRIP_VARS (extra_var_ids) and collect() runs once per step, after
+    # handle_step. A trip is completed from the vehicle's results of its last step: departure and departDelay are
+    # exact, the route length adds what was left of the last lane (arrival at the lane end, SUMO's default) and the
+    # time loss of the last step is missing (a fraction of a second).
+    # keep_trips also keeps every trip, for the pairwise diffs, which need them vehicle by vehicle.
+    def __init__(self, keep_trips=False):
+        self.stats = {"all": RunningStats()}
+        self.trips = [] if keep_trips else None
+        self.lane_lengths = {}
+        self.previous = {}
+
+    def collect(self, registry):
+        if registry.arrived:
+            arrival = traci.simulation.getTime() - traci.simulation.getDeltaT()
+            for vehID, vType in registry.arrived.items():
+                # a vehicle that arrived in the step it departed in was never seen, as in a tripinfo-less run
+                if vehID in self.previous:
+                    self.add(vehID, vType, self.previous[vehID], arrival)
+        self.previous = registry.results
+
+    def finish(self, registry):
+        # the arrivals of the last step, once the simulation has ended
+        registry.update()
+        self.collect(registry)
+
+    def add(self, vehID, vType, values, arrival):
+        lane = values[tc.VAR_LANE_ID]
+        if lane not in self.lane_lengths:
+            self.lane_lengths[lane] = traci.lane.getLength(lane)
+        duration = arrival - values[tc.VAR_DEPARTURE]
+        route_length = values[tc.VAR_DISTANCE] + self.lane_lengths[lane] - values[tc.VAR_LANEPOSITION]
+        depart_delay, time_loss = values[tc.VAR_DEPART_DELAY], values[tc.VAR_TIMELOSS]
+        metrics = (duration, depart_delay, route_length / duration, time_loss, depart_delay + time_loss)
+        if vType not in self.stats:
+            self.stats[vType] = RunningStats()
+        self.stats[vType].add(metrics)
+        self.stats["all"].add(metrics)
+        if self.trips is not None:
+            self.trips.append((vehID, vType) + metrics)
+
+    def summary(self):
+        # {vType: {stat: value}}, the layout of calc_stats (pd.DataFrame(summary) gives its table)
+        return {vType: stats.stats() for vType, stats in self.stats.items()}
+
+    def trips_df(self):
+        # the kept trips as the dataframe of read_tripinfo
+        import pandas as pd  # only with KEEP_TRIPS, when the run ends
+        ids, types, *metrics = zip(*self.trips) if self.trips else ((), ()) + ((),) * len(METRICS)
+        df = pd.DataFrame({metric: np.asarray(values, dtype=np.float32) for metric, values in zip(METRICS, metrics)})
+        df["vType"] = pd.Categorical(types)
+        df["id"] = np.asarray(ids, dtype=object)
+        return df[COLUMNS]
+
+    def write(self, summary_file, trips_file=None):
+        write_json_atomic(summary_file, self.summary())
+        if trips_file is not None:
+            save_cached(self.trips_df(), trips_file)
@@ -0,0 +1,142 @@
+import gzip
+import hashlib
+import os
+import xml.etree.ElementTree as ET
+import numpy as np
+
+from common.files import atomic_open
+
+# tripinfo attributes kept as float32 columns
+FLOAT_ATTRS = ["duration", "departDelay", "routeLength", "timeLoss"]
+# rough size of one <tripinfo/> element on disk, used to preallocate the columns before parsing
+BYTES_PER_TRIP = 400
+GZIP_MAGIC = b"\x1f\x8b"
+# parsed runs are kept here as .npz files, keyed by the tripinfo path, size and mtime
+CACHE_DIR = "tripinfo_cache"
+# column order of the dataframes returned by read_tripinfo/load_tripinfo
+COLUMNS = ["duration", "departDelay", "vType", "timeLoss", "id", "speed", "totalDelay"]
+FLOAT_COLUMNS = [col for col in COLUMNS if col not in ("vType", "id")]
+
+
+def resolve_tripinfo_path(path):
+    # SUMO writes compressed output when the file name ends with .gz, so accept either spelling
+    if not os.path.exists(path) and os.path.exists(path + ".gz"):
+        return path + ".gz"
+    return path
+
+
+def trips_file_name(path):
+    # where a run with online metrics (trip_metrics.TripCollector) keeps its trips, in place of the tripinfo XML
+    return path[:-len(".xml")] + ".trips.npz"
+
+
+def open_tripinfo(path):
+    with open(path, "rb") as f:
+        compressed = f.read(2) == GZIP_MAGIC
+    return gzip.open(path, "rb") if compressed else open(path, "rb")
+
+
+def read_tripinfo(path):
+    # Stream a tripinfo file into typed columns: elements are cleared as soon as they are read, so memory holds only
+    # the columns themselves (float32 metrics, categorical vType) and never the XML tree
+    import pandas as pd  # here, the simulation workers import this module but build no dataframes
+    path = resolve_tripinfo_path(path)
+    capacity = max(1024, os.path.getsize(path) // BYTES_PER_TRIP)
+    ids = np.empty(capacity, dtype=object)
+    type_codes = np.empty(capacity, dtype=np.int16)
+    values = np.empty((len(FLOAT_ATTRS), capacity), dtype=np.float32)
+    categories = {}
+    n = 0
+    with open_tripinfo(path) as f:
+        context = ET.iterparse(f, events=("start", "end"))
+        _, root = next(context)
+        for event, elem in context:
+            if event == "start" or elem.tag != "tripinfo":
+                continue
+            if n == capacity:
+                capacity *= 2
+                ids = np.resize(ids, capacity)
+                type_codes = np.resize(type_codes, capacity)
+                values = np.concatenate([values, np.empty_like(values)], axis=1)
+            ids[n] = elem.get("id")
+            type_codes[n] = categories.setdefault(elem.get("vType"), len(categories))
+            for i, attr in enumerate(FLOAT_ATTRS):
+                values[i, n] = float(elem.get(attr))
+            n += 1
+            # drop the parsed element (and its empty shell under the root)
+            root.clear()
+
+    columns = dict(zip(FLOAT_ATTRS, values[:, :n]))
+    df = pd.DataFrame({"duration": columns["duration"],
+                       "departDelay": columns["departDelay"],
+                       "vType": pd.Categorical.from_codes(type_codes[:n], categories=list(categories)),
+                       "timeLoss": columns["timeLoss"],
+                       "id": ids[:n]})
+    df["speed"] = columns["routeLength"] / columns["duration"]
+    df["totalDelay"] = columns["departDelay"] + columns["timeLoss"]
+    return df
+
+
+def cache_file_prefix(path, cache_dir):
+    path_key = hashlib.sha1(os.path.abspath(path).encode()).hexdigest()[:10]
+    return os.path.join(cache_dir, f"{os.path.basename(path)}.{path_key}.")
+
+
+def cache_file_name(path, cache_dir):
+    # a re-simulated run changes size and/or mtime, hence the name, so stale entries are never read
+    stat = os.stat(path)
+    version_key = hashlib.sha1(f"{stat.st_size}_{stat.st_mtime_ns}".encode()).hexdigest()[:10]
+    return cache_file_prefix(path, cache_dir) + f"{version_key}.npz"
+
+
+def save_cached(df, cache_file):
+    # renamed only once complete, so concurrent readers never see a partial file
+    with atomic_open(cache_file, "wb") as f:
+        np.savez(f, id=df["id"].to_numpy(dtype=str), vType_codes=df["vType"].cat.codes.to_numpy(),
+                 vType_categories=np.asarray(df["vType"].cat.categories, dtype=str),
+                 **{col: df[col].to_numpy() for col in FLOAT_COLUMNS})
+
+
+def load_cached(cache_file):
+    import pandas as pd
+    with np.load(cache_file) as data:
+        columns = {col: data[col] for col in FLOAT_COLUMNS}
+        columns["id"] = data["id"]
+        columns["vType"] = pd.Categorical.from_codes(data["vType_codes"], categories=list(data["vType_categories"]))
+    return pd.DataFrame({col: columns[col] for col in COLUMNS})
+
+
+def load_tripinfo(path, cache_dir=CACHE_DIR):
+    # read_tripinfo with an on-disk columnar cache, so every run is parsed once across analyses and processes
+    path = resolve_tripinfo_path(path)
+    if not os.path.exists(path) and os.path.exists(trips_file_name(path)):
+        return load_cached(trips_file_name(path))
+    if cache_dir is None:
+        return read_tripinfo(path)
+    cache_file = cache_file_name(path, cache_dir)
+    if os.path.exists(cache_file):
+        return load_cached(cache_file)
+    df = read_tripinfo(path)
+    os.makedirs(cache_dir, exist_ok=True)
+    # remove the entries of earlier versions of this run
+    prefix = cache_file_prefix(path, cache_dir)
+    for name in os.listdir(cache_dir):
+        stale_file = os.path.join(cache_dir, name)
+        if stale_file.startswith(prefix) and stale_file.endswith(".npz"):
+            os.remove(stale_file)
+    save_cached(df, cache_file)
+    return df
+
+
+def prepend_trips(prefix_path, path):
+    # Copy the trips of prefix_path (a warm-up run) to the top of the tripinfo file path (a run forked from it), so
+    # path holds the trips of the whole simulation. Relies on SUMO's layout: one root start tag per line.
+    with open(prefix_path) as f:
+        lines = f.readlines()
+    start = next(i for i, line in enumerate(lines) if line.lstrip().startswith("<tripinfos")) + 1
+    end = max(i for i, line in enumerate(lines) if line.lstrip().startswith("</tripinfos>"))
+    with open(path) as src, atomic_open(path) as dst:
+        for line in src:
+            dst.write(line)
+            if line.lstrip().startswith("<tripinfos"):
+                dst.writelines(lines[start:end])
@@ -1,140 +1,67 @@
 import os
-import traci
-import imageio
-import xml.etree.ElementTree as ET
+import sys
+import json
+import glob
 import pandas as pd
-import numpy as np
 from tqdm import tqdm
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", ".."))
+from common.backend import traci
+from common.registry import VehicleRegistry
+from common.experiment import expand
+from common.bootstrap import bootstrap_sums, percentile_ci
+# the simulation side, re-exported for the recordings and the benchmarks
+from controller import STATE_VARS, SPEC, REPLICATION_FILE, POLICY_RULES, handle_step, configure_routes
+from tripinfo import load_tripinfo
+from result_store import ResultStore
 
 exp_name = "emergency"
 NUM_REPS = 1
 GUI = True
 sumoCfg = fr"../{exp_name}.sumocfg"
-results_folder = "results_csvs_server_dur86400"
+# the recordings need sumo-gui, from SUMO_HOME or else from the PATH
+sumoBinary = os.path.join(os.environ["SUMO_HOME"], "bin", "sumo-gui" if GUI else "sumo") if "SUMO_HOME" in os.environ \
+    else ("sumo-gui" if GUI else "sumo")
 metrics = ["duration", "departDelay", "speed", "timeLoss", "totalDelay"]
-
-
-
-def handle_step(t, policy_name):
-    vehIDs = traci.vehicle.getIDList()
-    has_emergency = False
-    for vehID in vehIDs:
-        lane = traci.vehicle.getLaneID(vehID)
-        if traci.vehicle.getTypeID(vehID) == "emergency":
-            if policy_name == "ClearFront" or policy_name == "ClearFront_HD50":
-                # clear all vehicles in front of the emergency vehicle
-                leader = traci.vehicle.getLeader(vehID, 0)
-                while leader:
-                    frontVehID, dist = leader
-                    if traci.vehicle.getTypeID(frontVehID) == "AV" and traci.vehicle.getLaneID(frontVehID) == lane:
-                        to_lane = 1 if lane.endswith("2") else 0
-                        traci.vehicle.changeLane(frontVehID, to_lane, 1)
-                    leader = traci.vehicle.getLeader(frontVehID, 0)
-            if policy_name == "ClearFront500" or policy_name == "ClearFront500_HD50":
-                leader = traci.vehicle.getLeader(vehID, 0)
-                dist_emer = 0
-                while leader and dist_emer < 500:
-                    frontVehID, dist = leader
-                    dist_emer += dist
-                    if traci.vehicle.getTypeID(frontVehID) == "AV" and traci.vehicle.getLaneID(frontVehID) == lane and \
-                            dist_emer < 500:
-                        to_lane = 1 if lane.endswith("2") else 0
-                        traci.vehicle.changeLane(frontVehID, to_lane, 1)
-                    leader = traci.vehicle.getLeader(frontVehID, 0)
-            if policy_name == "ClearFront_HD50" or policy_name == "HD50" or policy_name == "ClearFront500_HD50":
-                # clear also HD vehicles in front of the emergency vehicle (up to 50m)
-                leader = traci.vehicle.getLeader(vehID, 0)
-                dist_emer = 0
-                while leader and dist_emer < 50:
-                    frontVehID, dist = leader
-                    dist_emer += dist
-                    if traci.vehicle.getTypeID(frontVehID) != "emergency" and traci.vehicle.getLaneID(frontVehID)\
-                            == lane and dist_emer < 50:
-                        to_lane = 1 if lane.endswith("2") else 0
-                        traci.vehicle.changeLane(frontVehID, to_lane, 1)
-                    leader = traci.vehicle.getLeader(frontVehID, 0)
-    return has_emergency
-
-
-def set_MajorFlow_vehsPerHour(vehsPerHour):
-    # Load and parse the XML file
-    tree = ET.parse(f'../{exp_name}.rou.xml')
-    root = tree.getroot()
-
-    # Find the 'MajorFlow' element
-    for flow in root.findall('flow'):
-        if flow.get('id') == 'MajorFlow':
-            flow.set('vehsPerHour', str(vehsPerHour))
-            break
-
-    # Save the changes back to the file
-    tree.write(f'../{exp_name}.rou.xml')
-
-
-def set_sim_duration(sim_duration):
-    # Load and parse the XML file
-    tree = ET.parse(f'../{exp_name}.rou.xml')
-    root = tree.getroot()
-
-    # Find the 'MajorFlow' element
-    for flow in root.findall('flow'):
-        flow.set('end', str(sim_duration))
-
-    # Save the changes back to the file
-    tree.write(f'../{exp_name}.rou.xml')
-
-
-def set_sumo_simulation(major_rate, sim_duration):
-    set_MajorFlow_vehsPerHour(major_rate)
-    set_sim_duration(sim_duration)
-
-
-def record_sumo_simulation_to_gif(major_rate, policy_name, record_duration=180, desired_slow_speed=0, av_prob=0.5):
+vType_names = ["AV", "HD", "emergency", "all"]
+# the pairwise tables give the paired bootstrap percentile interval of every avg_*_diff (ci_low_*/ci_high_* columns,
+# see common/bootstrap.py) from BOOTSTRAP_REPS replicates; 0 leaves them out
+BOOTSTRAP_REPS = 1000
+CONFIDENCE = 0.95
+# the per-(policy, AV rate) csvs written from the result store, and the pickles of the long runs from before it
+CSV_FOLDER = "results_csvs"
+LEGACY_RESULTS_FOLDER = "results_csvs_server_dur86400"
+
+
+def record_sumo_simulation_to_gif(major_rate, policy_name, record_duration=180, desired_slow_speed=0, av_prob=0.5,
+                                  frame_every=1, frame_scale=1):
+    # record_duration=None records the whole simulation; frame_every/frame_scale thin out long recordings
+    from common.recorder import GifRecorder  # Pillow, only for the recordings
+    # the run of the sweep with this flow and AV share
+    gif_file = f"results_gifs/{exp_name}_{major_rate}Major_{desired_slow_speed}DSS_{av_prob}AVprob_{policy_name}.gif"
+    os.makedirs(os.path.dirname(gif_file), exist_ok=True)
+    run = expand(dict(SPEC, grid=dict(SPEC["grid"], flow=[major_rate], av_prob=[av_prob])), configure_routes)[0]
     # Start SUMO simulation
-    traci.start(sumoCmd)
-
-    frames = []
-
-    step = 0
-    while traci.simulation.getMinExpectedNumber() > 0:
-        handle_step(step, av_prob, policy_name)
-        if "frames" not in os.listdir():
-            os.mkdir("frames")
-        image_file = f"frames/frame_{step}.png"
-        # Capture the current state of the simulation as an image
-        traci.gui.screenshot("View #0", image_file)
-        traci.simulationStep()
-        step += 1
-        if step > record_duration:
-            break
-    traci.close(False)
-    for s in range(step):
-        frame_name = f"frames/frame_{s}.png"
-        frames.append(imageio.imread(frame_name))
-        os.remove(frame_name)
-    # Create a GIF from the captured frames
-    imageio.mimsave(
-        f"results_gifs/{exp_name}_{major_rate}Major_{desired_slow_speed}DSS_{av_prob}AVprob_{policy_name}.gif", frames,
-        fps=10)
+    traci.start([sumoBinary] + run.sumo_args())
+    registry = VehicleRegistry(STATE_VARS)
+
+    # frames are appended to the GIF as the simulation runs
+    with GifRecorder(gif_file, fps=10, every=frame_every, scale=frame_scale) as recorder:
+        step = 0
+        while traci.simulation.getMinExpectedNumber() > 0:
+            handle_step(step, policy_name, registry)
+            # Capture the current state of the simulation as an image
+            recorder.capture(step)
+            traci.simulationStep()
+            step += 1
+            if record_duration is not None and step > record_duration:
+                break
+        traci.close(False)
 
 
 def output_file_to_df(output_file, num_reps):
-    # Parse the XML file into pd dataframe
-    tree = ET.parse(output_file)
-    root = tree.getroot()
-
-    dict = {"duration": [], "departDelay": [], "routeLength": [], "vType": [], "timeLoss": [], "id": []}
-    for tripinfo in root.findall('tripinfo'):
-        for key in dict.keys():
-            dict[key].append(tripinfo.get(key))
-    df = pd.DataFrame(dict)
-    df["speed"] = df.routeLength.astype(float) / df.duration.astype(float)
-    df["totalDelay"] = df.departDelay.astype(float) + df.timeLoss.astype(float)
-    df.drop(columns=["routeLength"], inplace=True)
-    # convert to float except vType
-    for col in df.columns:
-        if col != "vType" and col != "id":
-            df[col] = df[col].astype(float)
+    # Stream the tripinfo XML (plain or .xml.gz) into a dataframe with compact column types, or load it from the
+    # tripinfo cache if this version of the file was parsed before
+    df = load_tripinfo(output_file)
     if num_reps > 1:
         df = calc_mean(df)
     return df
@@ -172,15 +99,20 @@ def calc_stats(df, diff=False):
     return pd.DataFrame(stats)
 
 
-def parse_output_files(av_rates, num_reps, policy_name, flow):
-    # Aggregate all output files into one dataframe, divided by vType
+def stats_columns(diff=False):
+    # the (vType, stat) columns of a results table
+    metrics_stats = [f"{metric}_diff" for metric in metrics] if diff else metrics
+    stats_names = [f"avg_{metric}" for metric in metrics_stats] + [f"std_{metric}" for metric in metrics_stats]
+    if diff and BOOTSTRAP_REPS:
+        stats_names += [f"ci_low_{metric}" for metric in metrics_stats] + \
+                       [f"ci_high_{metric}" for metric in metrics_stats]
+    stats_names += ["count"]
+    return pd.MultiIndex.from_product([vType_names, stats_names], names=['vType', 'stat'])
 
-    # set MultiIndex for df - each vType will be a column in df with all the stats
-    stats_names = [f"avg_{metric}" for metric in metrics] + [f"std_{metric}" for metric in metrics]+ ["count"]
-    vType_names = ["AV", "HD", "emergency", "all"]
-    df = pd.DataFrame(columns=pd.MultiIndex.from_product([vType_names, stats_names], names=['vType', 'stat']),
-                      index=av_rates)
 
+def parse_output_files(av_rates, num_reps, policy_name, flow):
+    # Aggregate all output files into the stats of every (av_rate, vType), saved to the result store
+    stats = {}
     for av_rate in av_rates:
         df_av_rate = pd.DataFrame()
         for i in range(num_reps):
@@ -190,99 +122,181 @@ def parse_output_files(av_rates, num_reps, policy_name, flow):
             df_rep = output_file_to_df(output_file, num_reps)
             df_av_rate = pd.concat([df_av_rate, df_rep])
         # Calculate statistics per vType
-        stats_av_rate = calc_stats(df_av_rate)
-        # Add to df
-        for vType in vType_names:
-            if vType not in stats_av_rate.columns:
-                continue
-            for stat in stats_names:
-                df.loc[av_rate, (vType, stat)] = stats_av_rate.loc[stat, vType]
-    # Save df to csv
+        stats[av_rate] = calc_stats(df_av_rate).T.rename_axis("vType")
+    stats = pd.concat(stats, names=["av_rate"]).assign(reps=num_reps, policy=policy_name, flow=flow)
+    ResultStore().write("stats", stats)
+
+
+def pairwise_run_name(flow, av_rate):
+    return f"emergency_flow{flow}_av{av_rate}_emer{0.003}"
+
+
+def pairwise_output_file(policy_name, run_name, num_reps):
     if num_reps == 1:
-        df.to_csv(f"results_csvs/{policy_name}_flow_{flow}_long.csv")
-        df.to_pickle(f"results_csvs/{policy_name}_flow_{flow}_long.pkl")
-        return
-    df.to_csv(f"results_csvs/{policy_name}_flow_{flow}.csv")
-    df.to_pickle(f"results_csvs/{policy_name}_flow_{flow}.pkl")
+        return f"results_reps_long/{policy_name}_{run_name}.xml"
+    return f"results_reps/{policy_name}_{run_name}.xml"
+
+
+def replicated_runs(replication_file=REPLICATION_FILE):
+    # {(policy, run name): the runs of its reps} as adaptive_simulation recorded them, empty without adaptive reps
+    if not os.path.exists(replication_file):
+        return {}
+    with open(replication_file) as f:
+        return {(cell["policy"], cell["run"]): cell["rep_runs"] for cell in json.load(f) if "rep_runs" in cell}
+
+
+def pairwise_diffs(runs, baseline):
+    # Percent difference of every metric of every trip in runs (all compared policies, with a "policy" column) against
+    # the same trip in the baseline run, computed with a single join
+    categories = runs.vType.cat.categories.union(baseline.vType.cat.categories)
+    runs = runs.assign(vType=runs.vType.cat.set_categories(categories))
+    baseline = baseline.assign(vType=baseline.vType.cat.set_categories(categories))
+    df = pd.merge(runs, baseline.drop(columns=["policy"], errors="ignore"), on=["id", "vType"],
+                  suffixes=["", "_baseline"], how="inner")
+    matched = df.groupby("policy", observed=True).size()
+    for policy_name, count in runs.groupby("policy", observed=True).size().items():
+        if not count == matched.get(policy_name, 0) == len(baseline):
+            print(f"{policy_name}: matched {matched.get(policy_name, 0)} trips, {count} in the policy run, "
+                  f"{len(baseline)} in the baseline run")
+    diffs = df[["policy", "vType"]].copy()
+    for metric in metrics:
+        diffs[f"{metric}_diff"] = (df[metric] - df[f"{metric}_baseline"]) / df[f"{metric}_baseline"] * 100
+    return diffs
+
+
+def diff_cis(diffs, per_vType, per_all):
+    # Paired bootstrap percentile intervals of the mean diffs of the groups of per_vType and of per_all, in the order of
+    # their groups, as {None: (low, high), "all": (low, high)}. The vehicles of a group over all vTypes are resampled
+    # together, so its interval also covers the variation of the vType mix.
+    values = diffs[[f"{metric}_diff" for metric in metrics]].to_numpy()
+    return {vType: percentile_ci(*bootstrap_sums(values, grouped.ngroup().to_numpy(), BOOTSTRAP_REPS), CONFIDENCE)
+            for grouped, vType in [(per_vType, None), (per_all, "all")]}
+
+
+def diff_stats(diffs, keys):
+    # avg/std/count of every diff metric per keys + vType, and per keys over all vehicles (vType "all"), with their
+    # confidence intervals if BOOTSTRAP_REPS
+    diff_metrics = [f"{metric}_diff" for metric in metrics]
+    per_vType = diffs.groupby(keys + ["vType"], observed=True)
+    per_all = diffs.groupby(keys, observed=True)
+    cis = diff_cis(diffs, per_vType, per_all) if BOOTSTRAP_REPS and len(diffs) else {}
+    stats = []
+    for grouped, vType in [(per_vType, None), (per_all, "all")]:
+        agg = grouped[diff_metrics].agg(["mean", "std"])
+        df = pd.DataFrame({f"avg_{metric}": agg[(metric, "mean")] for metric in diff_metrics})
+        df = df.join(pd.DataFrame({f"std_{metric}": agg[(metric, "std")] for metric in diff_metrics}))
+        if cis:
+            low, high = cis[vType]
+            df = df.join(pd.DataFrame(low, index=df.index, columns=[f"ci_low_{metric}" for metric in diff_metrics]))
+            df = df.join(pd.DataFrame(high, index=df.index, columns=[f"ci_high_{metric}" for metric in diff_metrics]))
+        df["count"] = grouped.size()
+        if vType is not None:
+            df = pd.concat({vType: df}, names=["vType"]).reorder_levels(keys + ["vType"])
+        stats.append(df)
+    stats = pd.concat(stats)
+    stats.index = stats.index.set_levels(stats.index.levels[-1].astype(str), level=-1)
+    return stats
+
+
+def pairwise_stats(policy_names, flows, av_rates, num_reps, baseline_name="Nothing"):
+    # Pairwise stats of all policies against the baseline, one row per (policy, flow, av_rate, vType). Each
+    # (flow, av_rate) cell loads its baseline once per rep and joins all policies against it in one go, which keeps
+    # memory bounded by a single cell's trips. A cell has the run of the sweep as its only rep, unless adaptive reps
+    # recorded more for a policy: the trips of all its reps are pooled, each rep paired with the baseline of its seed.
+    replicated = replicated_runs() if num_reps == 1 else {}
+    cells = {}
+    for flow in tqdm(flows):
+        for av_rate in av_rates:
+            run_name = pairwise_run_name(flow, av_rate)
+            rep_runs = {policy_name: replicated.get((policy_name, run_name), [run_name])
+                        for policy_name in policy_names}
+            diffs = []
+            for rep_name in dict.fromkeys(name for names in rep_runs.values() for name in names):
+                baseline = output_file_to_df(pairwise_output_file(baseline_name, rep_name, num_reps), num_reps)
+                runs = pd.concat([output_file_to_df(pairwise_output_file(policy_name, rep_name, num_reps), num_reps)
+                                  .assign(policy=policy_name)
+                                  for policy_name in policy_names if rep_name in rep_runs[policy_name]],
+                                 ignore_index=True)
+                diffs.append(pairwise_diffs(runs, baseline))
+            if diffs:  # empty when no rep of any policy succeeded
+                cells[(flow, av_rate)] = diff_stats(pd.concat(diffs, ignore_index=True), ["policy"])
+    return pd.concat(cells, names=["flow", "av_rate"]).reorder_levels(["policy", "flow", "av_rate", "vType"])
+
+
+def pairwise_table(policy_names, flows, av_rates, num_reps, baseline_name="Nothing"):
+    # pairwise_stats indexed by (policy, flow, av_rate), with the (vType, stat) columns of the per-policy tables
+    stats = pairwise_stats(policy_names, flows, av_rates, num_reps, baseline_name)
+    table = stats.unstack("vType").swaplevel(axis=1)
+    table.columns.names = ["vType", "stat"]
+    return table.reindex(columns=stats_columns(diff=True))
+
+
+def save_pairwise(stats, num_reps, baseline_name="Nothing"):
+    # pairwise_stats to the result store, replacing earlier results of the same (policy, flow, av_rate)s
+    ResultStore().write("pairwise", stats.assign(reps=num_reps, baseline=baseline_name))
 
 
 def parse_output_files_pairwise(av_rates, num_reps,flow, policy_name1, policy_name2="Nothing"):
-    # set MultiIndex for df - each vType will be a column in df with all the stats
-    stats_names = [f"avg_{metric}_diff" for metric in metrics] + [f"std_{metric}_diff" for metric in metrics] + ["count"]
-    vType_names = ["AV", "HD", "emergency", "all"]
-    df = pd.DataFrame(columns=pd.MultiIndex.from_product([vType_names, stats_names], names=['vType', 'stat']),
-                      index=av_rates)
+    stats = pairwise_stats([policy_name1], [flow], av_rates, num_reps, baseline_name=policy_name2)
+    save_pairwise(stats, num_reps, policy_name2)
 
-    for av_rate in av_rates:
-        df_av_rate = pd.DataFrame()
-        for i in range(num_reps):
-            output_file1 = f"results_reps/{policy_name1}_emergency_flow{flow}_av{av_rate}_emer{0.003}.xml"
-            output_file2 = f"results_reps/{policy_name2}_emergency_flow{flow}_av{av_rate}_emer{0.003}.xml"
-            if num_reps == 1:
-                output_file1 = f"results_reps_long/{policy_name1}_emergency_flow{flow}_av{av_rate}_emer{0.003}.xml"
-                output_file2 = f"results_reps_long/{policy_name2}_emergency_flow{flow}_av{av_rate}_emer{0.003}.xml"
-            df_rep1 = output_file_to_df(output_file1, num_reps)
-            df_rep2 = output_file_to_df(output_file2, num_reps)
-            df_rep = pd.merge(df_rep1, df_rep2, on=["id","vType"], suffixes=[f"_{policy_name1}", f"_{policy_name2}"],
-                              how="inner")
-            # calculate difference
-            try:
-                assert len (df_rep) == len(df_rep1) == len(df_rep2)
-            except:
-                print(f"len(df_rep) = {len(df_rep)}, len(df_rep1) = {len(df_rep1)}, len(df_rep2) = {len(df_rep2)}")
-                # print the ids that are not in both dataframes and the vTypes
-                print(df_rep1[~df_rep1.id.isin(df_rep.id)][["id","vType"]])
-                print("*"*50)
-                print(df_rep2[~df_rep2.id.isin(df_rep.id)][["id","vType"]])
-                print("*"*50)
-
-            for metric in metrics:
-                df_rep[f"{metric}_diff"] = ((df_rep[f"{metric}_{policy_name1}"] - df_rep[f"{metric}_{policy_name2}"])/\
-                                           df_rep[f"{metric}_{policy_name2}"]) * 100
-            df_rep.drop(columns=[f"{metric}_{policy_name1}" for metric in metrics], inplace=True)
-            df_rep.drop(columns=[f"{metric}_{policy_name2}" for metric in metrics], inplace=True)
-            df_av_rate = pd.concat([df_av_rate, df_rep])
-        # Calculate statistics per vType
-        stats_av_rate = calc_stats(df_av_rate, diff=True)
-        # Add to df
-        for vType in vType_names:
-            if vType not in stats_av_rate.columns:
-                continue
-            for stat in stats_names:
-                df.loc[av_rate, (vType, stat)] = stats_av_rate.loc[stat, vType]
-    # Save df to csv
-    if num_reps == 1:
-        df.to_csv(f"results_csvs/{policy_name1}_{policy_name2}_flow_{flow}_long.csv")
-        df.to_pickle(f"results_csvs/{policy_name1}_{policy_name2}_flow_{flow}_long.pkl")
-        return
-    df.to_csv(f"results_csvs/{policy_name1}_{policy_name2}_flow_{flow}.csv")
-    df.to_pickle(f"results_csvs/{policy_name1}_{policy_name2}_flow_{flow}.pkl")
 
 def parse_all_pairwise():
-    for major_flow in tqdm([6000,7000,8000,9000,10000]):
-        av_rates = [0.0, 0.1, 0.2, 0.3, 0.4, 0.5, 0.6, 0.7, 0.8, 0.9, 0.997]
-        for policy_name in ["ClearFront500", "ClearFront500_HD50","ClearFront","HD50","ClearFront_HD50"]:
-            parse_output_files_pairwise(av_rates, NUM_REPS, major_flow, policy_name, policy_name2="Nothing")
-
-def convert_flows_to_av_rates():
-    # convert flows to av rates
-    flows = [1000, 2000, 3000, 4000, 5000, 6000, 7000, 8000, 9000, 10000]
+    flows = [6000,7000,8000,9000,10000]
     av_rates = [0.0, 0.1, 0.2, 0.3, 0.4, 0.5, 0.6, 0.7, 0.8, 0.9, 0.997]
-    for policy_name in ["ClearFront500", "ClearFront500_HD50", "ClearFront", "HD50", "ClearFront_HD50"]:
-        for av_rate in av_rates:
-            stats_names = [f"avg_{metric}_diff" for metric in metrics] + [f"std_{metric}_diff" for metric in
-                                                                          metrics] + ["count"]
-            vType_names = ["AV", "HD", "emergency", "all"]
-            df = pd.DataFrame(columns=pd.MultiIndex.from_product([vType_names, stats_names], names=['vType', 'stat']),
-                              index=flows)
-            for flow in flows:
-                df_flow = pd.read_pickle(f"{results_folder}/{policy_name}_Nothing_flow_{flow}_long.pkl")
-                df.loc[flow] = df_flow.loc[av_rate]
-            df.to_csv(f"{results_folder}/{policy_name}_Nothing_av_rate_{av_rate}.csv")
-            df.to_pickle(f"{results_folder}/{policy_name}_Nothing_av_rate_{av_rate}.pkl")
-
+    policy_names = ["ClearFront500", "ClearFront500_HD50","ClearFront","HD50","ClearFront_HD50"]
+    save_pairwise(pairwise_stats(policy_names, flows, av_rates, NUM_REPS, baseline_name="Nothing"), NUM_REPS)
+
+
+def load_pairwise(index, num_reps=NUM_REPS, baseline_name="Nothing", **filters):
+    # Pairwise results from the result store, e.g. load_pairwise("av_rate", policy="HD50", flow=6000) for the
+    # table of one (policy, flow), or load_pairwise(["policy", "av_rate", "flow"]) for every policy and AV rate
+    # across flows, read at once
+    table = ResultStore().table("pairwise", index, reps=num_reps, baseline=baseline_name, **filters)
+    return table.reindex(columns=stats_columns(diff=True))
+
+
+def convert_flows_to_av_rates(num_reps=NUM_REPS, baseline_name="Nothing"):
+    # the pairwise results of every policy and AV rate across flows, {(policy, av_rate): table indexed by flow}, from
+    # a single read of the result store
+    table = load_pairwise(["policy", "av_rate", "flow"], num_reps, baseline_name)
+    return {key: df.droplevel(["policy", "av_rate"]) for key, df in table.groupby(level=["policy", "av_rate"])}
+
+
+def export_av_rate_csvs(folder=CSV_FOLDER, num_reps=NUM_REPS, baseline_name="Nothing"):
+    # the tables of convert_flows_to_av_rates as <policy>_<baseline>_av_rate_<av_rate>.csv, one row per flow
+    os.makedirs(folder, exist_ok=True)
+    for (policy_name, av_rate), df in convert_flows_to_av_rates(num_reps, baseline_name).items():
+        df.to_csv(os.path.join(folder, f"{policy_name}_{baseline_name}_av_rate_{av_rate}.csv"))
+
+
+def import_legacy_results(folder=LEGACY_RESULTS_FOLDER):
+    # One-off import of the per-(policy, flow) pickles of the long runs written before the result store:
+    # <policy>_flow_<flow>_long.pkl (stats) and <policy>_<baseline>_flow_<flow>_long.pkl (pairwise), each indexed by
+    # av_rate with (vType, stat) columns. Policy names hold underscores, so the names are matched against the known
+    # policies. The imported pairwise results have no confidence intervals.
+    store = ResultStore()
+    for path in sorted(glob.glob(os.path.join(folder, "*_flow_*_long.pkl"))):
+        names, flow = os.path.basename(path)[:-len("_long.pkl")].rsplit("_flow_", 1)
+        if names in POLICY_RULES:
+            dataset, keys = "stats", {"policy": names}
+        else:
+            pairs = [(policy_name, names[len(policy_name) + 1:]) for policy_name in POLICY_RULES
+                     if names.startswith(policy_name + "_") and names[len(policy_name) + 1:] in POLICY_RULES]
+            if len(pairs) != 1:
+                print(f"skipping {path}: not a policy or a pair of policies")
+                continue
+            dataset, keys = "pairwise", {"policy": pairs[0][0], "baseline": pairs[0][1]}
+        # the pickled tables were filled cell by cell, hence of object dtype, with empty rows for missing vTypes
+        stats = pd.read_pickle(path).stack("vType").apply(pd.to_numeric).dropna(how="all")
+        stats = stats.reindex(columns=stats_columns(diff=dataset == "pairwise").unique("stat"))
+        store.write(dataset, stats.rename_axis(["av_rate", "vType"]).assign(reps=1, flow=int(flow), **keys))
+        print(f"imported {path}")
 
 
 if __name__ == '__main__':
-    # Example usage
-    convert_flows_to_av_rates()
+    # python utils.py [import [folder]]: the stored pairwise results (simulation_run.py stores them after a sweep) as
+    # per-(policy, AV rate) csvs across flows; "import" first imports the pickles of an earlier results folder
+    if sys.argv[1:2] == ["import"]:
+        import_legacy_results(*sys.argv[2:3])
+    export_av_rate_csvs()
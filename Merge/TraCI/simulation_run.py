@@ -1,73 +1,191 @@
 import os
 import sys
+import random
+import tempfile
 import numpy as np
-import pandas as pd
 if 'SUMO_HOME' in os.environ:
     sys.path.append(os.path.join(os.environ['SUMO_HOME'], 'tools'))
-from tqdm import tqdm
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", ".."))
 from multiprocessing import Pool
-import traci
-from utils import handle_step, set_sumo_simulation, record_sumo_simulation_to_gif
+from common.backend import traci
+from common.warmup import SAVE_STATE_OPTIONS, save_warmup, fork_from
+from common.experiment import expand
+from common.profiling import Profiler
+from common.replication import AdaptiveReplication
+from utils import handle_step, update_vehicles, is_merging, configure_routes, STATE_VARS, VehicleRegistry, \
+    DETECT_MERGING_LOC, SLOW_LOC, SLOW_LEN
 
 GUI = False
+# simulator backend: "traci" (socket), "libsumo" (in-process, no GUI) or "fake" (pure Python, no SUMO needed)
+BACKEND = os.environ.get("SIM_BACKEND", "traci")
+# SIM_PROFILE=1 writes a profile of the TraCI calls and step phases of every task to PROFILE_DIR
+PROFILE = os.environ.get("SIM_PROFILE", "0") == "1"
+PROFILE_DIR = "profiles"
 
 # SIM parameters
 NUM_REPS = 10
 SIM_DURATION = 600
+# simulate each (AV probability, rep) up to its first merge once, and run the slow speeds from that saved state.
+# SUMO does not restore the insertion queue exactly, so forked runs match full runs statistically, not step by step
+SHARED_WARMUP = False
+# run the reps of every (slow speed, AV probability) in batches of REP_BATCH, until the confidence interval of its mean
+# step count is narrower than CI_WIDTH steps (or MAX_REPS), instead of NUM_REPS each. The sweep spends at most
+# NUM_REPS per cell on average, what the quiet cells do not use goes to the noisy ones
+ADAPTIVE_REPS = False
+CI_WIDTH = 10
+REP_BATCH = 3
+MAX_REPS = 3 * NUM_REPS
 
 # Traffic parameters
 MAJOR_FLOW = 2500
 AV_PROB = None # testing many AV probabilities
+AV_PROBS = np.arange(0, 1.1, 0.1)
 
-# Controllable parameters
-DETECT_MERGING_LOC = 40
-SLOW_LOC = 35
-SLOW_LEN = 15
+# Controllable parameters (the merge geometry, DETECT_MERGING_LOC, SLOW_LOC and SLOW_LEN, is in utils)
 DESIRED_SLOW_SPEED = None # testing many desired slow speeds
 
-sumoCfg = r"..\merge.sumocfg"
-sumoBinary = r"C:\Program Files (x86)\Eclipse\Sumo\bin\sumo-gui.exe" if GUI else \
-    r"C:\Program Files (x86)\Eclipse\Sumo\bin\sumo.exe"
-sumoCmd = [sumoBinary, "-c", sumoCfg]
+# the simulated traffic, see common/experiment.py. Every run gets its own route file, ../merge.rou.xml is only read
+SPEC = {
+    "name": "merge_flow{flow}_dur{duration}",
+    "net_file": os.path.join("..", "merge.net.xml"),
+    "route_template": os.path.join("..", "merge.rou.xml"),
+    "options": {"junction-taz": "true"},
+    "grid": {"flow": [MAJOR_FLOW], "duration": [SIM_DURATION]},
+}
 
+# SUMO from SUMO_HOME, or else from the PATH; every worker runs it with the arguments of the run (see start_worker)
+sumoBinary = os.path.join(os.environ["SUMO_HOME"], "bin", "sumo-gui" if GUI else "sumo") if "SUMO_HOME" in os.environ \
+    else ("sumo-gui" if GUI else "sumo")
+traci.use(BACKEND)
 
 
-def simulate(desired_slow_speed):
-    speed_results_avg = []
-    speed_results_std = []
-    for av_prob in np.arange(0, 1.1, 0.1):
-        speed_prob_results = []
-        for _ in range(NUM_REPS):
-            traci.start(sumoCmd)
-            step = 0
-            while traci.simulation.getMinExpectedNumber() > 0:
-                handle_step(step, av_prob, DETECT_MERGING_LOC, SLOW_LOC, SLOW_LEN, desired_slow_speed)
+
+def start_worker(cmd):
+    # every pool worker keeps one SUMO instance for all its reps, reset with traci.load instead of relaunched
+    global sumoCmd
+    sumoCmd = cmd
+    traci.start(sumoCmd)
+
+
+def simulate(task):
+    desired_slow_speed, av_index, rep = task
+    # plain floats: libsumo does not accept numpy scalars
+    av_prob, slow_speed = float(AV_PROBS[av_index]), float(desired_slow_speed)
+    traci.load(sumoCmd[1:])
+    # the AV/HD assignment depends only on (av_prob, rep), whichever worker runs the task, so every slow speed is
+    # compared on the same draws
+    random.seed(rep * len(AV_PROBS) + av_index)
+    registry = VehicleRegistry(STATE_VARS)
+    return task, run_from(0, av_prob, slow_speed, registry, task)
+
+
+def run_from(step, av_prob, slow_speed, registry, task):
+    profiler = Profiler(PROFILE)
+    with profiler.attached():
+        while traci.simulation.getMinExpectedNumber() > 0:
+            with profiler.phase("handle_step"):
+                handle_step(step, av_prob, DETECT_MERGING_LOC, SLOW_LOC, SLOW_LEN, slow_speed, registry)
+            with profiler.phase("simulationStep"):
                 traci.simulationStep(step)
-                step += 1
-            speed_prob_results.append(step)
-            traci.close(False)
-        speed_results_avg.append(np.mean(speed_prob_results))
-        speed_results_std.append(np.std(speed_prob_results))
-    return f"slow_speed_{desired_slow_speed}_avg", f"slow_speed_{desired_slow_speed}_std", speed_results_avg, speed_results_std
+            profiler.end_step()
+            step += 1
+    if profiler.enabled:
+        desired_slow_speed, av_index, rep = task
+        os.makedirs(PROFILE_DIR, exist_ok=True)
+        profiler.write(os.path.join(PROFILE_DIR, f"speed{desired_slow_speed}_av{av_index}_rep{rep}.profile.json"))
+    return step
+
+
+def simulate_forked(task):
+    # The slow speed only matters once a merge is detected, so the steps before it are simulated once per
+    # (AV probability, rep) and every slow speed continues from the saved state, with the same AV/HD draws to come
+    desired_slow_speeds, av_index, rep = task
+    av_prob = float(AV_PROBS[av_index])
+    state_file = os.path.join(tempfile.gettempdir(), f"merge_warmup_{os.getpid()}.state.xml.gz")
+    traci.load(sumoCmd[1:] + SAVE_STATE_OPTIONS)
+    random.seed(rep * len(AV_PROBS) + av_index)
+    registry = VehicleRegistry(STATE_VARS)
+
+    def merging(step):
+        # stops before the slowdowns of the first merging step, after its type draws (which the forks then skip)
+        return is_merging(update_vehicles(av_prob, registry), DETECT_MERGING_LOC)
+
+    fork_step = save_warmup(state_file, merging)
+    random_state = random.getstate()
+    results = []
+    for desired_slow_speed in desired_slow_speeds:
+        fork_from(state_file, registry)
+        random.setstate(random_state)
+        step = run_from(fork_step, av_prob, float(desired_slow_speed), registry, (desired_slow_speed, av_index, rep))
+        results.append(((desired_slow_speed, av_index, rep), step))
+    os.remove(state_file)
+    return results
+
+
+def run_task(task):
+    # [(task, steps)] of every (slow speed, AV probability, rep) the task covers
+    return simulate_forked(task) if SHARED_WARMUP else [simulate(task)]
+
+
+def run_tasks(pool, tasks):
+    # {(slow speed, AV probability, rep): steps} of the given reps, one task per rep, so all workers stay busy until
+    # the end of the batch. With SHARED_WARMUP, one task per (AV probability, rep) covers all its slow speeds
+    from tqdm import tqdm  # here, the pool workers import this module too
+    if SHARED_WARMUP:
+        slow_speeds = {}
+        for desired_slow_speed, av_index, rep in tasks:
+            slow_speeds.setdefault((av_index, rep), []).append(desired_slow_speed)
+        tasks = [(tuple(speeds), av_index, rep) for (av_index, rep), speeds in slow_speeds.items()]
+    steps = {}
+    for results in tqdm(pool.imap_unordered(run_task, tasks), total=len(tasks)):
+        steps.update(results)
+    return steps
+
+
+def run_adaptive(pool, desired_slow_speeds):
+    cells = [(desired_slow_speed, av_index) for desired_slow_speed in desired_slow_speeds
+             for av_index in range(len(AV_PROBS))]
+    replication = AdaptiveReplication(cells, CI_WIDTH, batch=REP_BATCH, max_reps=MAX_REPS,
+                                      budget=NUM_REPS * len(cells))
+    steps = {}
+    # rep r of every slow speed has the same AV/HD draws (see simulate), whatever the number of reps of each cell
+    while batch := replication.next_batch():
+        results = run_tasks(pool, [cell + (rep,) for cell, reps in batch.items() for rep in reps])
+        for (desired_slow_speed, av_index, rep), n in results.items():
+            replication.add((desired_slow_speed, av_index), n)
+        steps.update(results)
+        print(f"{replication.spent()} reps run, {sum(map(replication.done, cells))}/{len(cells)} cells done")
+    return steps, replication
 
 
-def parallel_simulation(desired_slow_speeds):
-    with Pool(10) as pool:  # 10 processes
-        results = list(tqdm(pool.imap(simulate, desired_slow_speeds), total=len(desired_slow_speeds)))
+def parallel_simulation(desired_slow_speeds, run):
+    with Pool(10, initializer=start_worker, initargs=([sumoBinary] + run.sumo_args(),)) as pool:  # 10 processes
+        if ADAPTIVE_REPS:
+            steps, replication = run_adaptive(pool, desired_slow_speeds)
+        else:
+            steps = run_tasks(pool, [(desired_slow_speed, av_index, rep) for desired_slow_speed in desired_slow_speeds
+                                     for av_index in range(len(AV_PROBS)) for rep in range(NUM_REPS)])
+    cell_steps = {}
+    for (desired_slow_speed, av_index, rep), n in sorted(steps.items(), key=lambda item: item[0][2]):
+        cell_steps.setdefault((desired_slow_speed, av_index), []).append(n)
 
     # Organize results into a DataFrame
-    df = pd.DataFrame(index=np.arange(0, 1.1, 0.1))
-    for result in results:
-        avg_key, std_key, avg_values, std_values = result
-        df[avg_key] = avg_values
-        df[std_key] = std_values
-    df.index = np.arange(0, 1.1, 0.1)
-    df.to_csv(f"results_{NUM_REPS}_{MAJOR_FLOW}Major_{SIM_DURATION}Duration.csv")
+    import pandas as pd
+    df = pd.DataFrame(index=AV_PROBS)
+    for desired_slow_speed in desired_slow_speeds:
+        speed_prob_results = [cell_steps[(desired_slow_speed, av_index)] for av_index in range(len(AV_PROBS))]
+        df[f"slow_speed_{desired_slow_speed}_avg"] = [np.mean(results) for results in speed_prob_results]
+        df[f"slow_speed_{desired_slow_speed}_std"] = [np.std(results) for results in speed_prob_results]
+        if ADAPTIVE_REPS:
+            df[f"slow_speed_{desired_slow_speed}_reps"] = [len(results) for results in speed_prob_results]
+            df[f"slow_speed_{desired_slow_speed}_ci"] = [replication.ci_width((desired_slow_speed, av_index))
+                                                         for av_index in range(len(AV_PROBS))]
+    reps = "adaptive" if ADAPTIVE_REPS else NUM_REPS
+    df.to_csv(f"results_{reps}_{run.params['flow']}Major_{run.params['duration']}Duration.csv")
 
 if __name__ == "__main__":
     desired_slow_speeds = np.arange(0, 10, 1)
-    set_sumo_simulation(MAJOR_FLOW, SIM_DURATION)
-    # record_sumo_simulation_to_gif(MAJOR_FLOW)
-    parallel_simulation(desired_slow_speeds)
+    for run in expand(SPEC, configure_routes):
+        parallel_simulation(desired_slow_speeds, run)
 
 
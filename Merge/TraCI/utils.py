@@ -1,9 +1,10 @@
 import os
-import traci
-import imageio
+import sys
 from random import random
-import xml.etree.ElementTree as ET
-from simulation_run import DETECT_MERGING_LOC, SLOW_LOC, SLOW_LEN
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", ".."))
+from common.backend import traci
+from common import constants as tc
+from common.registry import VehicleRegistry
 
 exp_name = "merge"
 GUI = True
@@ -13,87 +14,74 @@ sumoBinary = r"C:\Program Files (x86)\Eclipse\Sumo\bin\sumo-gui.exe" if GUI else
 sumoCmd = [sumoBinary, "-c", sumoCfg]
 
 MajorFlow_vehsPerHour = 2500
+# where the controller detects a merging vehicle and slows the AVs, in m along the lanes
+DETECT_MERGING_LOC = 40
+SLOW_LOC = 35
+SLOW_LEN = 15
 
+# Vehicle variables handle_step reads each step, delivered in one subscription response (type comes from the registry)
+STATE_VARS = (tc.VAR_SPEED, tc.VAR_LANE_ID, tc.VAR_LANEPOSITION)
 
-def handle_step(t, av_prob, detect_merging_loc, slow_loc, slow_len, desired_slow_speed):
-    vehIDs = traci.vehicle.getIDList()
-    merging = False
-    for vehID in vehIDs:
-        if traci.vehicle.getTypeID(vehID) == "DEFAULT_VEHTYPE":
-            traci.vehicle.setType(vehID, "AV" if random() < av_prob else "HD")
-        speed, lane, lanePos = traci.vehicle.getSpeed(vehID), traci.vehicle.getLaneID(vehID), \
-            traci.vehicle.getLanePosition(vehID)
-        if lane == "E2_0" and lanePos > detect_merging_loc:
-            merging = True
-        # print(vehID, ": ", lane, " SPEED:", speed, " LANEPOS:", lanePos, " TYPE:", traci.vehicle.getTypeID(vehID))
-    if merging:
-        for vehID in vehIDs:
-            if traci.vehicle.getLaneID(vehID) == "E0_0" and traci.vehicle.getTypeID(vehID) == "AV" and \
-                    slow_loc < traci.vehicle.getLanePosition(vehID) < slow_loc + slow_len:
-                # Slow down the vehicle to specific period of time
-                traci.vehicle.slowDown(vehID, desired_slow_speed, 1)
-
-    return True
-
-
-def set_MajorFlow_vehsPerHour(vehsPerHour):
-    # Load and parse the XML file
-    tree = ET.parse(f'../{exp_name}.rou.xml')
-    root = tree.getroot()
 
-    # Find the 'MajorFlow' element
-    for flow in root.findall('flow'):
-        if flow.get('id') == 'MajorFlow':
-            flow.set('vehsPerHour', str(vehsPerHour))
-            break
+def update_vehicles(av_prob, registry):
+    # assign AV/HD once, when the vehicle is inserted. Vehicles that already have a type keep it, so calling this
+    # twice in a step (warm-up and fork, see simulation_run) draws nothing the second time.
+    for vehID in registry.update():
+        if registry.types[vehID] == "DEFAULT_VEHTYPE":
+            registry.set_type(vehID, "AV" if random() < av_prob else "HD")
+    return registry.snapshot()
 
-    # Save the changes back to the file
-    tree.write(f'../{exp_name}.rou.xml')
 
+def is_merging(states, detect_merging_loc):
+    for vehID, (vType, speed, lane, lanePos) in states.items():
+        if lane == "E2_0" and lanePos > detect_merging_loc:
+            return True
+        # print(vehID, ": ", lane, " SPEED:", speed, " LANEPOS:", lanePos, " TYPE:", vType)
+    return False
 
-def set_sim_duration(sim_duration):
-    # Load and parse the XML file
-    tree = ET.parse(f'../{exp_name}.rou.xml')
-    root = tree.getroot()
 
-    # Find the 'MajorFlow' element
-    for flow in root.findall('flow'):
-        flow.set('end', str(sim_duration))
+def handle_step(t, av_prob, detect_merging_loc, slow_loc, slow_len, desired_slow_speed, registry):
+    states = update_vehicles(av_prob, registry)
+    if is_merging(states, detect_merging_loc):
+        for vehID, (vType, speed, lane, lanePos) in states.items():
+            if lane == "E0_0" and vType == "AV" and slow_loc < lanePos < slow_loc + slow_len:
+                # Slow down the vehicle to specific period of time
+                registry.commands.slow_down(vehID, desired_slow_speed, 1)
+        registry.commands.flush()
 
-    # Save the changes back to the file
-    tree.write(f'../{exp_name}.rou.xml')
+    return True
 
 
-def set_sumo_simulation(major_rate, sim_duration):
-    set_MajorFlow_vehsPerHour(major_rate)
-    set_sim_duration(sim_duration)
+def configure_routes(routes, params):
+    # experiment.expand hook: set the MajorFlow rate and the duration of one run on the parsed route template
+    for flow in routes.findall('flow'):
+        if flow.get('id') == 'MajorFlow':
+            flow.set('vehsPerHour', str(params["flow"]))
+        flow.set('end', str(params["duration"]))
+    return params
 
 
-def record_sumo_simulation_to_gif(major_rate, record_duration=180, desired_slow_speed=0, av_prob=0.5):
+def record_sumo_simulation_to_gif(major_rate, record_duration=180, desired_slow_speed=0, av_prob=0.5, frame_every=1,
+                                  frame_scale=1):
+    # record_duration=None records the whole simulation; frame_every/frame_scale thin out long recordings
+    from common.recorder import GifRecorder  # Pillow, only for the recordings
     # Start SUMO simulation
     traci.start(sumoCmd)
-
-    frames = []
-
-    step = 0
-    while traci.simulation.getMinExpectedNumber() > 0:
-        handle_step(step, av_prob, DETECT_MERGING_LOC, SLOW_LOC, SLOW_LEN, desired_slow_speed)
-        if "frames" not in os.listdir():
-            os.mkdir("frames")
-        image_file = f"frames/frame_{step}.png"
-        # Capture the current state of the simulation as an image
-        traci.gui.screenshot("View #0", image_file)
-        traci.simulationStep()
-        step += 1
-        if step > record_duration:
-            break
-    traci.close()
-    for s in range(step):
-        frame_name = f"frames/frame_{s}.png"
-        frames.append(imageio.imread(frame_name))
-        os.remove(frame_name)
-    # Create a GIF from the captured frames
-    imageio.mimsave(f"{major_rate}Major_{desired_slow_speed}DSS_{av_prob}AVprob.gif", frames, fps=10)
+    registry = VehicleRegistry(STATE_VARS)
+
+    # frames are appended to the GIF as the simulation runs
+    with GifRecorder(f"{major_rate}Major_{desired_slow_speed}DSS_{av_prob}AVprob.gif", fps=10, every=frame_every,
+                     scale=frame_scale) as recorder:
+        step = 0
+        while traci.simulation.getMinExpectedNumber() > 0:
+            handle_step(step, av_prob, DETECT_MERGING_LOC, SLOW_LOC, SLOW_LEN, desired_slow_speed, registry)
+            # Capture the current state of the simulation as an image
+            recorder.capture(step)
+            traci.simulationStep()
+            step += 1
+            if record_duration is not None and step > record_duration:
+                break
+        traci.close()
 
 
 if __name__ == '__main__':
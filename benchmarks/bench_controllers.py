@@ -0,0 +1,236 @@
+"""Benchmark the handle_step controllers of EmergencyCar and Merge against the fake backend (no SUMO needed).
+
+Each emergency benchmark fills the lanes with vehicles at a given density (the merge benchmark feeds its road with its
+flows), then times handle_step alone over a fixed number of steps (simulationStep is excluded). A second, profiled
+pass of the same deterministic run counts the TraCI calls.
+
+    python benchmarks/bench_controllers.py --scenario emergency --lanes 3 --density 20 40 80 --emergencies 1 4
+    python benchmarks/bench_controllers.py --scenario merge --major-flows 2500 10000 --json bench.json
+"""
+import os
+import sys
+import time
+import json
+import random
+import argparse
+import tempfile
+import importlib.util
+import itertools
+import xml.etree.ElementTree as ET
+import numpy as np
+
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..")
+sys.path.append(ROOT)
+from common.backend import traci
+from common.profiling import Profiler
+from common import fake_sumo
+
+EMERGENCY_POLICIES = ["Nothing", "ClearFront", "ClearFront500", "HD50", "ClearFront_HD50", "ClearFront500_HD50"]
+
+
+def load_utils(scenario):
+    # both scenarios name their controller module utils, so each is loaded under its own name
+    scenario_dir = os.path.join(ROOT, {"emergency": "EmergencyCar", "merge": "Merge"}[scenario], "TraCI")
+    sys.path.insert(0, scenario_dir)  # for the modules utils imports from its own directory
+    try:
+        spec = importlib.util.spec_from_file_location(f"{scenario}_utils", os.path.join(scenario_dir, "utils.py"))
+        module = importlib.util.module_from_spec(spec)
+        spec.loader.exec_module(module)
+    finally:
+        sys.path.remove(scenario_dir)
+    return module
+
+
+def write_net(path, lanes, length, speed=33.33):
+    net = ET.Element("net")
+    edge = ET.SubElement(net, "edge", id="E0", attrib={"from": "J0", "to": "J2"})
+    for index in range(lanes):
+        ET.SubElement(edge, "lane", id=f"E0_{index}", index=str(index), speed=str(speed), length=str(length))
+    ET.ElementTree(net).write(path)
+
+
+def write_vtypes(path, route_template):
+    # the vehicle types of the scenario, without its flows: the benchmark places every vehicle itself
+    routes = ET.parse(route_template).getroot()
+    for flow in routes.findall("flow"):
+        routes.remove(flow)
+    ET.ElementTree(routes).write(path)
+
+
+def populate(density, draw_type, rng):
+    # Place vehicles on every lane of the fake simulation, density per km, with random gaps around the mean spacing,
+    # and report them as departed so the controller's registry picks them up at the first step
+    sim = fake_sumo.getConnection()
+    edge_to = {edge_id: to for edges in sim.junction_edges.values() for edge_id, to in edges}
+    vehicles = []
+    for edge_id, lanes in sim.edges.items():
+        # follow the first outgoing edge to the end of the net
+        route = [edge_id]
+        while sim.junction_edges.get(edge_to[route[-1]]):
+            route.append(sim.junction_edges[edge_to[route[-1]]][0][0])
+        flow = {"id": "bench", "route": route, "departLane": "first", "departSpeed": "0"}
+        for lane in lanes:
+            spacing = 1000. / density
+            pos = rng.uniform(spacing / 2, spacing)
+            while pos < lane.length:
+                vehicles.append((flow, lane, pos))
+                pos += rng.uniform(spacing / 2, spacing * 1.5)
+    for i, (flow, lane, pos) in enumerate(vehicles):
+        type_id = draw_type(i, lane, pos)
+        veh = fake_sumo.Vehicle(f"bench.{i}", type_id, sim.vtypes[type_id], flow, sim.time)
+        veh.lane, veh.pos, veh.depart, veh.depart_lane = lane, pos, sim.time, lane.id
+        veh.speed = lane.speed * veh.speed_factor * rng.uniform(0.5, 1)
+        sim.running[veh.id] = veh
+        sim.departed.append(veh.id)
+    return len(vehicles)
+
+
+def run_controller(handle_step, steps, profiler=None):
+    # times handle_step over `steps` steps; returns per-step latencies, vehicle counts and TraCI calls
+    latencies, vehicles, calls = [], [], []
+    for step in range(steps):
+        calls_before = sum(profiler.calls.values()) if profiler is not None else 0
+        start = time.perf_counter()
+        handle_step(step)
+        latencies.append(time.perf_counter() - start)
+        if profiler is not None:
+            calls.append(sum(profiler.calls.values()) - calls_before)
+        vehicles.append(len(fake_sumo.getConnection().running))
+        traci.simulationStep(step)
+    return np.array(latencies), np.array(vehicles), np.array(calls)
+
+
+def bench(setup, steps):
+    # setup() starts the fake simulation and returns the controller as handle_step(step); run once for the timings
+    # and once under the profiler for the call counts (the fake is deterministic, so both see the same steps)
+    handle_step = setup()
+    latencies, vehicles, _ = run_controller(handle_step, steps)
+    traci.close()
+    profiler = Profiler()
+    with profiler.attached():
+        handle_step = setup()
+        setup_calls = dict(profiler.calls)
+        _, _, calls = run_controller(handle_step, steps, profiler)
+        traci.close()
+    by_function = {name: (n - setup_calls.get(name, 0)) / steps for name, n in profiler.calls.items()
+                   if name != "simulationStep" and n > setup_calls.get(name, 0)}
+    return {
+        "vehicles": float(vehicles.mean()),
+        "step_ms_mean": float(latencies.mean() * 1000),
+        "step_ms_p50": float(np.percentile(latencies, 50) * 1000),
+        "step_ms_p99": float(np.percentile(latencies, 99) * 1000),
+        "rpc_per_step": float(calls.mean()),
+        "rpc_per_step_by_function": dict(sorted(by_function.items(), key=lambda item: -item[1])),
+        "vehicle_steps_per_s": float(vehicles.sum() / latencies.sum()),
+    }
+
+
+def bench_emergency(args, workdir):
+    utils = load_utils("emergency")
+    route_file = os.path.join(workdir, "emergency_vtypes.rou.xml")
+    write_vtypes(route_file, os.path.join(ROOT, "EmergencyCar", "emergency.rou.xml"))
+    results = []
+    for lanes, density, emergencies, policy_name in itertools.product(args.lanes, args.density, args.emergencies,
+                                                                      EMERGENCY_POLICIES):
+        net_file = os.path.join(workdir, f"emergency_{lanes}lanes.net.xml")
+        write_net(net_file, lanes, args.length)
+
+        def setup():
+            rng = random.Random(args.seed)
+            traci.start(["sumo", "-n", net_file, "-r", route_file, "--seed", str(args.seed)])
+            # the emergency vehicles are the rearmost ones, taking the lanes in turn, so they have traffic ahead
+            rear = {}
+
+            def draw_type(i, lane, pos):
+                rank = rear.setdefault(lane.id, 0)
+                rear[lane.id] += 1
+                if rank * lanes + lane.index < emergencies:
+                    return "emergency"
+                return "AV" if rng.random() < args.av_prob else "HD"
+
+            populate(density, draw_type, rng)
+            registry = utils.VehicleRegistry(utils.STATE_VARS)
+            return lambda step: utils.handle_step(step, policy_name, registry)
+
+        result = bench(setup, args.steps)
+        results.append(dict(scenario="emergency", lanes=lanes, density=density, emergencies=emergencies,
+                            policy=policy_name, **result))
+    return results
+
+
+def bench_merge(args, workdir):
+    # the merge road is too short to hold a placed density for long, so it is fed by its own flows instead, at the
+    # requested MajorFlow rates, and warmed up (untimed) before the measured steps
+    utils = load_utils("merge")
+    net_file = os.path.join(ROOT, "Merge", "merge.net.xml")
+    results = []
+    for major_flow, slow_speed in itertools.product(args.major_flows, args.slow_speeds):
+        route_file = os.path.join(workdir, f"merge_{major_flow}.rou.xml")
+        routes = ET.parse(os.path.join(ROOT, "Merge", "merge.rou.xml")).getroot()
+        utils.configure_routes(routes, {"flow": major_flow, "duration": args.warmup + args.steps + 1})
+        ET.ElementTree(routes).write(route_file)
+
+        def setup():
+            random.seed(args.seed)  # the controller's AV/HD draws
+            traci.start(["sumo", "-n", net_file, "-r", route_file, "--seed", str(args.seed)])
+            registry = utils.VehicleRegistry(utils.STATE_VARS)
+
+            def handle_step(step):
+                utils.handle_step(step, args.av_prob, utils.DETECT_MERGING_LOC, utils.SLOW_LOC, utils.SLOW_LEN,
+                                  slow_speed, registry)
+
+            for step in range(args.warmup):
+                handle_step(step)
+                traci.simulationStep(step)
+            return lambda step: handle_step(args.warmup + step)
+
+        result = bench(setup, args.steps)
+        results.append(dict(scenario="merge", major_flow=major_flow, slow_speed=slow_speed, **result))
+    return results
+
+
+def print_results(results):
+    keys = [key for key in ("lanes", "density", "emergencies", "policy", "major_flow", "slow_speed")
+            if key in results[0]]
+    header = keys + ["vehicles", "step_ms_mean", "step_ms_p99", "rpc_per_step", "vehicle_steps_per_s"]
+    print("  ".join(f"{key:>18}" for key in header))
+    for result in results:
+        print("  ".join(f"{result[key]:>18.3f}" if isinstance(result[key], float) else f"{result[key]:>18}"
+                        for key in header))
+
+
+def main():
+    parser = argparse.ArgumentParser(description="benchmark the handle_step controllers on the fake backend")
+    parser.add_argument("--scenario", choices=["emergency", "merge", "all"], default="all")
+    parser.add_argument("--lanes", type=int, nargs="+", default=[3], help="lanes of the emergency road")
+    parser.add_argument("--length", type=float, default=2000, help="length of the emergency road (m)")
+    parser.add_argument("--density", type=float, nargs="+", default=[20, 40, 80], help="vehicles per km and lane")
+    parser.add_argument("--emergencies", type=int, nargs="+", default=[1, 4])
+    parser.add_argument("--av-prob", type=float, default=0.5)
+    parser.add_argument("--major-flows", type=float, nargs="+", default=[2500, 5000, 10000],
+                        help="MajorFlow rates of the merge benchmark (veh/h)")
+    parser.add_argument("--slow-speeds", type=float, nargs="+", default=[0, 5])
+    parser.add_argument("--warmup", type=int, default=100, help="untimed steps before a merge benchmark")
+    parser.add_argument("--steps", type=int, default=50)
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument("--json", help="also write the results to this file")
+    args = parser.parse_args()
+
+    traci.use("fake")
+    results = []
+    with tempfile.TemporaryDirectory() as workdir:
+        if args.scenario in ("emergency", "all"):
+            results += bench_emergency(args, workdir)
+        if args.scenario in ("merge", "all"):
+            results += bench_merge(args, workdir)
+    for scenario in ("emergency", "merge"):
+        scenario_results = [result for result in results if result["scenario"] == scenario]
+        if scenario_results:
+            print_results(scenario_results)
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump(results, f, indent=1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,86 @@
+"""Check that what grows with the length of a run keeps its memory bounded (no SUMO needed, Linux).
+
+    python benchmarks/check_bounded.py
+    python benchmarks/check_bounded.py --frames 600 --steps 2000
+
+The recorder check samples the process's resident memory while the run goes on, and fails if it keeps growing after
+the first quarter of the run (allocator pools fill up until then). The profiler check runs the emergency controller
+on the fake backend and fails if the profiler keeps adding wrappers after the first quarter of the run.
+"""
+import os
+import sys
+import argparse
+import random
+import tempfile
+import numpy as np
+from PIL import Image
+
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..")
+sys.path.append(ROOT)
+from common.recorder import GifRecorder
+from common.backend import traci
+from common.profiling import Profiler
+import bench_controllers
+
+
+def rss_mb():
+    # current resident memory of this process
+    with open("/proc/self/statm") as f:
+        return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE") / 2 ** 20
+
+
+def check_recorder(frames, width=800, height=600, tolerance_mb=50):
+    # what GifRecorder does with sumo-gui screenshots, with random PNGs standing in for them
+    rng = np.random.default_rng(0)
+    samples = []
+    with tempfile.TemporaryDirectory() as work:
+        path, frame_dir = os.path.join(work, "recording.gif"), os.path.join(work, "frames")
+        with GifRecorder(path, fps=10, frame_dir=frame_dir) as recorder:
+            for step in range(frames):
+                recorder.hand_over()
+                recorder.requested = os.path.join(frame_dir, f"frame_{step}.png")
+                Image.fromarray(rng.integers(0, 256, (height, width, 3), dtype=np.uint8)).save(recorder.requested)
+                if (step + 1) % (frames // 4) == 0:
+                    samples.append(rss_mb())
+        with Image.open(path) as gif:
+            n_frames, size = gif.n_frames, gif.size
+    print("recorder: RSS " + ", ".join(f"{rss:.0f} MB" for rss in samples) + f" every {frames // 4} frames")
+    assert (n_frames, size) == (frames, (width, height)), f"GIF has {n_frames} frames of {size}"
+    assert max(samples) - samples[0] < tolerance_mb, "recorder memory grows with the number of frames"
+
+
+def check_profiler(steps, lanes=3, density=40):
+    # the TraCI calls of handle_step under the profiler, which wraps what it proxies once, not once per call
+    utils = bench_controllers.load_utils("emergency")
+    rng = random.Random(0)
+    samples = []
+    profiler = Profiler()
+    with tempfile.TemporaryDirectory() as work, profiler.attached():
+        net_file, route_file = os.path.join(work, "road.net.xml"), os.path.join(work, "vtypes.rou.xml")
+        bench_controllers.write_net(net_file, lanes, 2000)
+        bench_controllers.write_vtypes(route_file, os.path.join(ROOT, "EmergencyCar", "emergency.rou.xml"))
+        traci.start(["sumo", "-n", net_file, "-r", route_file])
+        bench_controllers.populate(density, lambda i, lane, pos: "emergency" if i == 0 else rng.choice(["AV", "HD"]),
+                                   rng)
+        registry = utils.VehicleRegistry(utils.STATE_VARS)
+        for step in range(steps):
+            utils.handle_step(step, "ClearFront_HD50", registry)
+            traci.simulationStep(step)
+            profiler.end_step()
+            if (step + 1) % (steps // 4) == 0:
+                samples.append(len(profiler.wrappers))
+        traci.close()
+    calls = sum(profiler.calls.values())
+    print(f"profiler: {calls} calls, wrappers " + ", ".join(map(str, samples)) + f" every {steps // 4} steps")
+    assert len(set(samples)) == 1, "profiler wrappers grow with the number of calls"
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--frames", type=int, default=300)
+    parser.add_argument("--steps", type=int, default=1000)
+    args = parser.parse_args()
+    traci.use("fake")
+    check_recorder(args.frames)
+    check_profiler(args.steps)
+    print("ok")
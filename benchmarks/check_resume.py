@@ -0,0 +1,48 @@
+"""Check that an EmergencyCar sweep resumes only the runs it can reuse (fake backend, no SUMO needed).
+
+    python benchmarks/check_resume.py
+
+Runs a small sweep, runs it again unchanged (nothing may run), then with a longer simulated duration, which keeps
+the runs' names and output files but must run them all again.
+"""
+import os
+import sys
+import json
+import tempfile
+
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..")
+sys.path.insert(0, os.path.join(ROOT, "EmergencyCar", "TraCI"))
+os.environ["SIM_BACKEND"] = "fake"
+import simulation_run
+
+
+def sweep(duration):
+    # the times the manifest records for the runs of a sweep of 2 flows x 2 policies
+    spec = dict(simulation_run.SPEC, net_file=os.path.join(ROOT, "EmergencyCar", "emergency.net.xml"),
+                route_template=os.path.join(ROOT, "EmergencyCar", "emergency.rou.xml"))
+    spec["grid"] = dict(spec["grid"], flow=[1000, 2000], av_prob=[0.5], duration=[duration])
+    runs = simulation_run.expand(spec, simulation_run.configure_routes)
+    simulation_run.parallel_simulation([(policy_name, run) for policy_name in ["Nothing", "HD50"] for run in runs])
+    with open(simulation_run.MANIFEST_FILE) as f:
+        return {key: (run["status"], run["updated"]) for key, run in json.load(f).items()}
+
+
+def check_resume():
+    simulation_run.NUM_PROCESSES = 2
+    with tempfile.TemporaryDirectory() as work:
+        os.chdir(work)
+        first = sweep(300)
+        again = sweep(300)
+        longer = sweep(600)
+        os.chdir(ROOT)
+    print(f"resume: {len(first)} runs, {sum(again[key] != first[key] for key in first)} run again unchanged, "
+          f"{sum(longer[key] != again[key] for key in again)} with a longer duration")
+    assert {status for status, _ in first.values()} == {"done"} and len(first) == 4
+    assert again == first, "an unchanged sweep ran again"
+    assert all(longer[key][1] > again[key][1] and longer[key][0] == "done" for key in again), \
+        "a sweep with a changed duration reused the old outputs"
+
+
+if __name__ == "__main__":
+    check_resume()
+    print("ok")
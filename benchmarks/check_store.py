@@ -0,0 +1,57 @@
+"""Check the result store of EmergencyCar on the shape of the pairwise results of a full sweep (no SUMO needed).
+
+    python benchmarks/check_store.py
+
+Writes random pairwise stats of parse_all_pairwise's 5 policies x 5 flows x 11 AV rates in one call, as
+save_pairwise does at the end of a sweep, then replaces the results of one flow and reads the cross views back.
+"""
+import os
+import sys
+import time
+import tempfile
+import numpy as np
+import pandas as pd
+
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..")
+sys.path.insert(0, os.path.join(ROOT, "EmergencyCar", "TraCI"))
+import utils
+
+POLICIES = ["ClearFront500", "ClearFront500_HD50", "ClearFront", "HD50", "ClearFront_HD50"]
+FLOWS = [6000, 7000, 8000, 9000, 10000]
+AV_RATES = [0.0, 0.1, 0.2, 0.3, 0.4, 0.5, 0.6, 0.7, 0.8, 0.9, 0.997]
+
+
+def pairwise_stats(rng, flows):
+    # the rows of utils.pairwise_stats, indexed by (policy, flow, av_rate, vType), with random stats
+    index = pd.MultiIndex.from_product([POLICIES, flows, AV_RATES, utils.vType_names],
+                                       names=["policy", "flow", "av_rate", "vType"])
+    stats = utils.stats_columns(diff=True).unique("stat")
+    return pd.DataFrame(rng.normal(size=(len(index), len(stats))), index=index, columns=stats)
+
+
+def check_store():
+    rng = np.random.default_rng(0)
+    with tempfile.TemporaryDirectory() as work:
+        os.chdir(work)
+        stats = pairwise_stats(rng, FLOWS)
+        utils.save_pairwise(stats, utils.NUM_REPS)
+        files = sum(len(names) for _, _, names in os.walk(os.path.join(work, utils.ResultStore().root)))
+        # a later parse of one flow replaces its rows and keeps the others
+        update = pairwise_stats(rng, [FLOWS[0]])
+        utils.save_pairwise(update, utils.NUM_REPS)
+        expected = pd.concat([update, stats.drop(FLOWS[0], level="flow")])
+        start = time.perf_counter()
+        views = utils.convert_flows_to_av_rates()
+        seconds = time.perf_counter() - start
+        table = utils.load_pairwise(["policy", "flow", "av_rate"])
+        os.chdir(ROOT)
+    print(f"store: {len(stats)} rows in {files} files, cross views read in {seconds:.2f} s")
+    assert len(views) == len(POLICIES) * len(AV_RATES), f"{len(views)} (policy, av_rate) views"
+    stored = table.stack("vType").reorder_levels(expected.index.names)
+    stored = stored.loc[expected.index, expected.columns]
+    assert np.allclose(stored.to_numpy(), expected.to_numpy()), "stored stats differ from the written ones"
+
+
+if __name__ == "__main__":
+    check_store()
+    print("ok")
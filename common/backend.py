@@ -0,0 +1,90 @@
+import os
+import threading
+import importlib
+
+# "traci": socket connection to a SUMO process, "libsumo": SUMO loaded in-process (no IPC, one simulation per
+# process, no GUI), "fake": the pure-Python stand-in in common/fake_sumo.py (no SUMO needed)
+BACKEND_MODULES = {"traci": "traci", "libsumo": "libsumo", "fake": "common.fake_sumo"}
+DEFAULT_BACKEND = os.environ.get("SIM_BACKEND", "traci")
+# traci.start is not thread-safe (it looks for a free port)
+START_LOCK = threading.Lock()
+
+
+class Backend:
+    # Stands in for the traci module: every attribute (vehicle, simulation, start, simulationStep, ...) is looked up
+    # on the selected implementation, so the simulation code is written once against the traci API.
+    # A thread bound to a connection label (see common/driver.py) starts its own labeled connection and every
+    # attribute it looks up is then that connection's, so several threads can drive one simulation each.
+    def __init__(self):
+        self.name = None
+        self.module = None
+        self.local = threading.local()
+
+    @property
+    def profiler(self):
+        # a common.profiling.Profiler, while one is attached: attributes are then returned wrapped in its timers
+        return getattr(self.local, "profiler", None)
+
+    @profiler.setter
+    def profiler(self, profiler):
+        self.local.profiler = profiler
+
+    def use(self, name):
+        if name not in BACKEND_MODULES:
+            raise ValueError(f"unknown simulator backend '{name}', expected one of {list(BACKEND_MODULES)}")
+        self.module = importlib.import_module(BACKEND_MODULES[name])
+        self.name = name
+        return self.module
+
+    def bind(self, label):
+        # the calling thread drives the connection `label` from now on (None: back to the module's current one)
+        if label is not None and self.module is None:
+            self.use(DEFAULT_BACKEND)
+        if label is not None and self.name == "libsumo":
+            raise ValueError("libsumo runs one simulation per process, use the traci or fake backend")
+        self.local.label = label
+        self.local.connection = None
+
+    def start(self, cmd, **kwargs):
+        if self.module is None:
+            self.use(DEFAULT_BACKEND)
+        start = self.module.start if self.profiler is None else self.profiler.wrap("start", self.module.start)
+        label = getattr(self.local, "label", None)
+        if label is None:
+            return start(cmd, **kwargs)
+        with START_LOCK:
+            result = start(cmd, label=label, doSwitch=False, **kwargs)
+        self.local.connection = self.module.getConnection(label)
+        return result
+
+    def close(self, wait=True):
+        # libsumo has no SUMO process to wait for and its close() takes no argument
+        if self.module is None:
+            self.use(DEFAULT_BACKEND)
+        connection = getattr(self.local, "connection", None)
+        if connection is not None:
+            self.local.connection = None
+            return connection.close(wait)
+        if self.name == "libsumo":
+            return self.module.close()
+        return self.module.close(wait)
+
+    def __getattr__(self, item):
+        if self.module is None:
+            self.use(DEFAULT_BACKEND)
+        local = self.local.__dict__
+        connection = local.get("connection")
+        if connection is None:
+            attr = getattr(self.module, item)
+        else:
+            # module-level names (constants, exceptions, ...) are not the connection's
+            attr = getattr(connection, item, None)
+            if attr is None:
+                attr = getattr(self.module, item)
+        profiler = local.get("profiler")
+        if profiler is not None:
+            return profiler.wrap(item, attr)
+        return attr
+
+
+traci = Backend()
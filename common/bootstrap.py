@@ -0,0 +1,64 @@
+import warnings
+import numpy as np
+
+# Paired bootstrap of the mean of per-trip values, e.g. the percent diffs of a trip under a policy against the same
+# trip under the baseline: resampling the trips resamples the pairs. Every group (policy, vType, ...) is resampled
+# within itself, many replicates at once and without a Python loop over trips: a chunk of replicates draws its trips
+# of the group in one call, the draws are counted per trip, and the replicates' sums are the product of these counts
+# with the group's values. A chunk holds at most CHUNK_DRAWS draws (and their counts): a group of more trips than
+# that draws each replicate in several chunks, adding up their counts.
+# The groups are resampled one after the other, and the callers bootstrap one (flow, av_rate) cell at a time, rather
+# than all cells in one pass: a group's draws stay within its trips, and a cell's trips are all in memory at once
+# anyway (see pairwise_stats in EmergencyCar/TraCI/utils.py).
+BOOTSTRAP_REPS = 1000
+CHUNK_DRAWS = 2 ** 22
+
+
+def bootstrap_sums(values, groups, reps=BOOTSTRAP_REPS, seed=0, chunk_draws=CHUNK_DRAWS):
+    # values: (trips, metrics), or (trips,) for a single metric; groups: (trips,) codes 0..n_groups-1.
+    # Returns (sums, counts), each (reps, n_groups, metrics): the sum and the number of the finite values of each metric
+    # in each replicate of each group. Values that are not finite (a percent diff against 0) are left out, the
+    # replicate's mean of a metric is sums / counts.
+    values = np.asarray(values, dtype=np.float64)
+    if values.ndim == 1:
+        values = values[:, None]
+    groups = np.asarray(groups, dtype=np.int64)
+    order = np.argsort(groups, kind="stable")
+    values, groups = values[order], groups[order]
+    n, m = values.shape
+    n_groups = int(groups.max()) + 1 if n else 0
+    sizes = np.bincount(groups, minlength=n_groups)
+    starts = np.cumsum(sizes) - sizes
+    finite = np.isfinite(values)
+    # the sums and the counts of a group come out of one product with its draw counts
+    weighted = np.hstack([np.where(finite, values, 0.0), finite])
+    rng = np.random.default_rng(seed)
+    out = np.zeros((reps, n_groups, 2 * m))
+    for group in np.flatnonzero(sizes):
+        start, size = starts[group], sizes[group]
+        if size > chunk_draws:
+            for rep in range(reps):
+                counts = np.zeros(size)
+                for first in range(0, size, chunk_draws):
+                    counts += np.bincount(rng.integers(0, size, min(chunk_draws, size - first)), minlength=size)
+                out[rep, group] = counts @ weighted[start:start + size]
+            continue
+        batch = chunk_draws // size
+        for first in range(0, reps, batch):
+            k = min(batch, reps - first)
+            draws = rng.integers(0, size, (k, size))
+            # replicate r counts its draws in [r * size, (r + 1) * size)
+            draws += np.arange(0, k * size, size)[:, None]
+            counts = np.bincount(draws.ravel(), minlength=k * size).reshape(k, size).astype(np.float64)
+            out[first:first + k, group] = counts @ weighted[start:start + size]
+    return out[..., :m], out[..., m:]
+
+
+def percentile_ci(sums, counts, confidence=0.95):
+    # the percentile interval of the replicates' means, (low, high), each (n_groups, metrics). NaN for a group without
+    # finite values
+    with np.errstate(invalid="ignore", divide="ignore"), warnings.catch_warnings():
+        warnings.simplefilter("ignore", RuntimeWarning)  # all-NaN groups
+        means = sums / counts
+        low, high = np.nanquantile(means, [(1 - confidence) / 2, (1 + confidence) / 2], axis=0)
+    return low, high
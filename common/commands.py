@@ -0,0 +1,30 @@
+from common.backend import traci
+
+
+class CommandBuffer:
+    # Collects the actuation commands a controller issues during a step and sends them in flush(), once per step.
+    # Repeated or conflicting commands of the same kind to the same vehicle in a step collapse into the last one,
+    # which is what sending them all in order would have left in effect. Every command is sent again each step it is
+    # issued: the controllers renew 1 s commands every 1 s step, which TraCI needs to keep them in effect.
+    def __init__(self):
+        self.pending = {}  # (function, vehID): (value, duration)
+        self.sent = 0
+        self.merged = 0
+
+    def add(self, function, vehID, value, duration):
+        if (function, vehID) in self.pending:
+            self.merged += 1
+        self.pending[(function, vehID)] = (value, duration)
+
+    def change_lane(self, vehID, lane_index, duration):
+        self.add("changeLane", vehID, lane_index, duration)
+
+    def slow_down(self, vehID, speed, duration):
+        self.add("slowDown", vehID, speed, duration)
+
+    def flush(self):
+        # send the commands of the step
+        for (function, vehID), (value, duration) in self.pending.items():
+            getattr(traci.vehicle, function)(vehID, value, duration)
+            self.sent += 1
+        self.pending.clear()
@@ -0,0 +1,14 @@
+# TraCI variable ids used by the scenarios. The values are fixed by the TraCI protocol, so they are the same for the
+# socket client, libsumo and the fake backend, and importing them does not require SUMO.
+VAR_DEPARTURE = 0x3a
+VAR_DEPART_DELAY = 0x3b
+VAR_SPEED = 0x40
+VAR_LENGTH = 0x44
+VAR_MINGAP = 0x4c
+VAR_TYPE = 0x4f
+VAR_ROAD_ID = 0x50
+VAR_LANE_ID = 0x51
+VAR_LANE_INDEX = 0x52
+VAR_LANEPOSITION = 0x56
+VAR_DISTANCE = 0x84
+VAR_TIMELOSS = 0x8c
@@ -0,0 +1,67 @@
+import queue
+import threading
+import multiprocessing
+
+from common.backend import traci
+
+# Several SUMO instances driven from one Python process, one thread each. A thread spends most of a step waiting for
+# its SUMO to compute it (the socket read releases the GIL), so the other threads run their handle_step meanwhile and
+# one process keeps several SUMO cores busy. Each thread is bound to its own labeled connection (traci.bind), which
+# every traci call of the thread then goes to; simulation code written for a single connection runs unchanged.
+# Needs the traci (or fake) backend: libsumo runs one simulation per process.
+POLL_SECONDS = 1
+
+
+def run_connections(target, connections):
+    # target() in `connections` threads at once, each with its own connection; re-raises the first error
+    errors = []
+
+    def drive(index):
+        traci.bind(f"driver.{index}")
+        try:
+            target()
+        except BaseException as e:
+            errors.append(e)
+        finally:
+            traci.bind(None)
+
+    threads = [threading.Thread(target=drive, args=(index,)) for index in range(connections)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    if errors:
+        raise errors[0]
+
+
+def serve(function, tasks, results, connections):
+    # put function(task) in results for every task of the queue, until a thread takes its None
+    def loop():
+        for task in iter(tasks.get, None):
+            results.put(function(task))
+    run_connections(loop, connections)
+
+
+def drive_pool(function, tasks, processes, connections):
+    # Yield function(task) for every task, in completion order, from `processes` processes driving `connections`
+    # simulations each. Like Pool.imap_unordered, function must not raise (report errors in its result instead).
+    tasks = list(tasks)
+    task_queue, results = multiprocessing.Queue(), multiprocessing.Queue()
+    for task in tasks:
+        task_queue.put(task)
+    for _ in range(processes * connections):
+        task_queue.put(None)
+    workers = [multiprocessing.Process(target=serve, args=(function, task_queue, results, connections))
+               for _ in range(processes)]
+    for worker in workers:
+        worker.start()
+    for _ in tasks:
+        while True:
+            try:
+                yield results.get(timeout=POLL_SECONDS)
+                break
+            except queue.Empty:
+                if not any(worker.is_alive() for worker in workers):
+                    raise RuntimeError("all driver processes exited before completing their tasks")
+    for worker in workers:
+        worker.join()
@@ -0,0 +1,73 @@
+import os
+import copy
+import json
+import hashlib
+import itertools
+import xml.etree.ElementTree as ET
+
+from common.files import write_bytes_atomic
+
+# A sweep is declared once, as a spec such as
+#   {"name": "emergency_flow{flow}_av{av_prob}_emer{emergency_prob}",  # formatted with each run's parameters
+#    "net_file": "../emergency.net.xml", "route_template": "../emergency.rou.xml",
+#    "options": {"junction-taz": "true"},                              # extra SUMO options of every run
+#    "grid": {"flow": [1000, 2000], "av_prob": [0.0, 0.5], "emergency_prob": [0.003], "seed": [6242],
+#             "duration": [86400]}}
+# and expanded into one Run per combination of the grid values. The route template is parsed once and each run's
+# routes are built in memory by a scenario-specific configure(routes, params). Route files are written once per
+# distinct content, named by its hash, and never modified, so several sweeps can share a node and a run directory.
+RUN_DIR = "runs"
+
+
+def content_hash(data):
+    return hashlib.sha256(data).hexdigest()[:16]
+
+
+class Run:
+    def __init__(self, name, params, net_file, routes, options):
+        self.name = name
+        self.params = params
+        self.net_file = os.path.abspath(net_file)
+        self.routes = routes  # route file content
+        self.options = options  # {option: value}, seed included
+        self.key = content_hash(routes + json.dumps(options, sort_keys=True).encode())
+
+    def route_file(self, run_dir=RUN_DIR):
+        # written on first use; identical content from another run or sweep maps to the same file
+        path = os.path.join(os.path.abspath(run_dir), f"{content_hash(self.routes)}.rou.xml")
+        if not os.path.exists(path):
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            write_bytes_atomic(path, self.routes)
+        return path
+
+    def sumo_args(self, run_dir=RUN_DIR):
+        # the SUMO command line of the run, without the binary
+        args = ["-n", self.net_file, "-r", self.route_file(run_dir)]
+        for option, value in self.options.items():
+            args += [f"--{option}", str(value)]
+        return args
+
+    def __repr__(self):
+        return f"Run({self.name!r}, {self.key})"
+
+
+def expand(spec, configure):
+    # The runs of a spec, in grid order. configure(routes, params) edits a copy of the parsed route template for one
+    # run and returns the run's effective parameters (it may normalise them); runs that end up identical are kept once.
+    template = ET.parse(spec["route_template"]).getroot()
+    runs = {}
+    names = {}
+    for values in itertools.product(*spec["grid"].values()):
+        routes = copy.deepcopy(template)
+        params = configure(routes, dict(zip(spec["grid"], values)))
+        options = dict(spec.get("options", {}))
+        if params.get("seed") is not None:
+            options["seed"] = params["seed"]
+        run = Run(spec["name"].format(**params), params, spec["net_file"], ET.tostring(routes), options)
+        if run.key in runs:
+            continue
+        if names.setdefault(run.name, run.key) != run.key:
+            raise ValueError(f"different runs share the name '{run.name}', add the parameters that differ to the "
+                             f"spec's name")
+        runs[run.key] = run
+    return list(runs.values())
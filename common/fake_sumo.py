@@ -0,0 +1,562 @@
+# Pure-Python stand-in for the parts of the TraCI API the scenarios use, so the control logic (and its cost) can run
+# on machines without SUMO. It reads the same .sumocfg/.net.xml/.rou.xml files, inserts the flows' vehicles
+# deterministically from the seed and moves them with a simple gap-keeping model. Trajectories are synthetic: they
+# do not reproduce SUMO's, only the interface and the order of magnitude of vehicles per step.
+import os
+import re
+import pickle
+import random
+import xml.etree.ElementTree as ET
+
+from common import constants
+
+DELTA_T = 1.0
+DEFAULT_SEED = 23423
+DEFAULT_VTYPE = "DEFAULT_VEHTYPE"
+DEFAULT_VTYPE_PARAMS = {"length": 5.0, "minGap": 2.5, "accel": 2.6, "decel": 4.5, "speedFactor": 1.0}
+# what saveState writes: everything that evolves during the run. Subscriptions, like SUMO's, are not part of the state
+STATE_FIELDS = ("rng", "edges", "vtypes", "distributions", "flows", "time", "running", "pending")
+
+
+class TraCIException(Exception):
+    pass
+
+
+class FatalTraCIError(Exception):
+    pass
+
+
+def parse_speed_factor(value):
+    # "normc(mean,dev,min,max)" or a plain number; the fake always uses the mean
+    match = re.match(r"\s*norm\w*\(\s*([-\d.]+)", value)
+    return float(match.group(1)) if match else float(value)
+
+
+def parse_options(cmd):
+    # Read the SUMO command line (and the configuration file it points to) into {option: value}
+    options = {}
+    args = list(cmd[1:])
+    while args:
+        key = args.pop(0).lstrip("-")
+        value = args.pop(0) if args and not args[0].startswith("-") else "true"
+        options[{"c": "configuration-file", "n": "net-file", "r": "route-files"}.get(key, key)] = value
+    if "configuration-file" in options:
+        cfg = options["configuration-file"]
+        base_dir = os.path.dirname(cfg)
+        for section in ET.parse(cfg).getroot():
+            for option in section:
+                value = option.get("value")
+                if option.tag in ("net-file", "route-files"):
+                    value = os.path.join(base_dir, value)
+                options.setdefault(option.tag, value)
+    return options
+
+
+class Lane:
+    def __init__(self, lane_id, index, length, speed, edge):
+        self.id = lane_id
+        self.index = index
+        self.length = length
+        self.speed = speed
+        self.edge = edge
+
+
+class Vehicle:
+    def __init__(self, veh_id, type_id, params, flow, desired_depart):
+        self.id = veh_id
+        self.flow = flow
+        self.route = flow["route"]
+        self.route_index = 0
+        self.desired_depart = desired_depart
+        self.depart = None
+        self.depart_lane = None
+        self.lane = None
+        self.pos = 0.
+        self.speed = 0.
+        self.distance = 0.
+        self.time_loss = 0.
+        self.slow_down = None  # (speed, until)
+        self.lane_change = None  # (lane index, until)
+        self.set_type(type_id, params)
+
+    def set_type(self, type_id, params):
+        self.type_id = type_id
+        self.length = params["length"]
+        self.min_gap = params["minGap"]
+        self.accel = params["accel"]
+        self.speed_factor = params["speedFactor"]
+
+
+VAR_GETTERS = {
+    constants.VAR_DEPARTURE: lambda veh: veh.depart,
+    constants.VAR_DEPART_DELAY: lambda veh: veh.depart - veh.desired_depart,
+    constants.VAR_SPEED: lambda veh: veh.speed,
+    constants.VAR_LENGTH: lambda veh: veh.length,
+    constants.VAR_MINGAP: lambda veh: veh.min_gap,
+    constants.VAR_TYPE: lambda veh: veh.type_id,
+    constants.VAR_ROAD_ID: lambda veh: veh.lane.edge,
+    constants.VAR_LANE_ID: lambda veh: veh.lane.id,
+    constants.VAR_LANE_INDEX: lambda veh: veh.lane.index,
+    constants.VAR_LANEPOSITION: lambda veh: veh.pos,
+    constants.VAR_DISTANCE: lambda veh: veh.distance,
+    constants.VAR_TIMELOSS: lambda veh: veh.time_loss,
+}
+
+
+class FakeSimulation:
+    # one simulation, with the per-connection API of traci's Connection (domains, simulationStep, load, close)
+    def __init__(self, cmd, label=None):
+        self.label = label
+        self.vehicle = VehicleDomain(self)
+        self.simulation = SimulationDomain(self)
+        self.lane = LaneDomain(self)
+        self.init(cmd)
+
+    def init(self, cmd):
+        options = parse_options(cmd)
+        self.rng = random.Random(int(options.get("seed", DEFAULT_SEED)))
+        self.edges = {}
+        self.vtypes = {DEFAULT_VTYPE: dict(DEFAULT_VTYPE_PARAMS)}
+        self.distributions = {}
+        self.flows = []
+        self.read_net(options["net-file"])
+        for route_file in options.get("route-files", "").split(","):
+            if route_file:
+                self.read_routes(route_file)
+        self.time = 0.
+        self.running = {}
+        self.pending = []
+        self.departed = []
+        self.arrived = []
+        self.subscriptions = {}
+        self.tripinfo = None
+        if "tripinfo-output" in options:
+            self.tripinfo = open(options["tripinfo-output"], "w")
+            self.tripinfo.write("<tripinfos>\n")
+
+    def read_net(self, net_file):
+        self.junction_edges = {}
+        for edge in ET.parse(net_file).getroot().findall("edge"):
+            if edge.get("function") == "internal":
+                continue
+            lanes = [Lane(lane.get("id"), int(lane.get("index")), float(lane.get("length")), float(lane.get("speed")),
+                          edge.get("id")) for lane in edge.findall("lane")]
+            self.edges[edge.get("id")] = sorted(lanes, key=lambda lane: lane.index)
+            self.junction_edges.setdefault(edge.get("from"), []).append((edge.get("id"), edge.get("to")))
+
+    def junction_route(self, from_junction, to_junction):
+        # breadth-first search over the edges of the net
+        paths = {from_junction: []}
+        frontier = [from_junction]
+        while frontier:
+            junction = frontier.pop(0)
+            if junction == to_junction:
+                return paths[junction]
+            for edge_id, to in self.junction_edges.get(junction, []):
+                if to not in paths:
+                    paths[to] = paths[junction] + [edge_id]
+                    frontier.append(to)
+        raise TraCIException(f"no route from junction {from_junction} to {to_junction}")
+
+    def read_vtype(self, vtype):
+        params = dict(DEFAULT_VTYPE_PARAMS)
+        for key in ("length", "minGap", "accel", "decel"):
+            if vtype.get(key) is not None:
+                params[key] = float(vtype.get(key))
+        if vtype.get("speedFactor") is not None:
+            params["speedFactor"] = parse_speed_factor(vtype.get("speedFactor"))
+        self.vtypes[vtype.get("id")] = params
+
+    def read_routes(self, route_file):
+        root = ET.parse(route_file).getroot()
+        routes = {route.get("id"): route.get("edges").split() for route in root.findall("route")}
+        for vtype in root.findall("vType"):
+            self.read_vtype(vtype)
+        for distribution in root.findall("vTypeDistribution"):
+            members = []
+            for vtype in distribution.findall("vType"):
+                self.read_vtype(vtype)
+                members.append((vtype.get("id"), float(vtype.get("probability", 1))))
+            self.distributions[distribution.get("id")] = members
+        for flow in root.findall("flow"):
+            if flow.get("route") is not None:
+                route = routes[flow.get("route")]
+            elif flow.get("fromJunction") is not None:
+                route = self.junction_route(flow.get("fromJunction"), flow.get("toJunction"))
+            else:
+                route = [flow.get("from")] + flow.get("via", "").split() + [flow.get("to")]
+            begin, end = float(flow.get("begin", 0)), float(flow.get("end", 3600))
+            if flow.get("vehsPerHour") is not None:
+                period = 3600 / float(flow.get("vehsPerHour"))
+            elif flow.get("number") is not None:
+                period = (end - begin) / float(flow.get("number"))
+            else:
+                period = float(flow.get("period"))
+            self.flows.append({"id": flow.get("id"), "type": flow.get("type", DEFAULT_VTYPE), "route": route,
+                               "begin": begin, "end": end, "period": period, "count": 0,
+                               "departLane": flow.get("departLane", "first"),
+                               "departSpeed": flow.get("departSpeed", "0")})
+
+    def draw_type(self, type_id):
+        if type_id not in self.distributions:
+            return type_id
+        members = self.distributions[type_id]
+        return self.rng.choices([member for member, _ in members], [prob for _, prob in members])[0]
+
+    # --- stepping ---
+
+    def simulationStep(self, step=0.):
+        # like TraCI: advance to the given time, or by one step if it is not in the future
+        target = max(step, self.time + DELTA_T)
+        self.departed, self.arrived = [], []
+        while self.time < target - 1e-9:
+            self.step()
+
+    def step(self):
+        for flow in self.flows:
+            while flow["begin"] + flow["count"] * flow["period"] <= min(self.time, flow["end"] - 1e-9):
+                type_id = self.draw_type(flow["type"])
+                self.pending.append(Vehicle(f"{flow['id']}.{flow['count']}", type_id, self.vtypes[type_id], flow,
+                                            flow["begin"] + flow["count"] * flow["period"]))
+                flow["count"] += 1
+        self.move()
+        self.change_lanes()
+        self.insert()
+        self.time += DELTA_T
+
+    def lane_vehicles(self):
+        # {laneID: vehicles on the lane, front first}
+        lanes = {}
+        for veh in self.running.values():
+            lanes.setdefault(veh.lane.id, []).append(veh)
+        for vehs in lanes.values():
+            vehs.sort(key=lambda veh: -veh.pos)
+        return lanes
+
+    def move(self):
+        for vehs in self.lane_vehicles().values():
+            leader = None
+            for veh in vehs:
+                max_speed = veh.lane.speed * veh.speed_factor
+                speed = min(veh.speed + veh.accel * DELTA_T, max_speed)
+                if veh.slow_down is not None:
+                    if self.time < veh.slow_down[1]:
+                        speed = min(speed, veh.slow_down[0])
+                    else:
+                        veh.slow_down = None
+                if leader is not None:
+                    gap = leader.pos - leader.length - veh.pos - veh.min_gap
+                    speed = min(speed, max(0., gap / DELTA_T))
+                veh.speed = speed
+                veh.pos += speed * DELTA_T
+                veh.distance += speed * DELTA_T
+                veh.time_loss += DELTA_T * max(0., 1 - speed / max_speed)
+                leader = veh
+            for veh in vehs:
+                while veh.id in self.running and veh.pos > veh.lane.length:
+                    self.advance_edge(veh)
+
+    def advance_edge(self, veh):
+        veh.route_index += 1
+        if veh.route_index == len(veh.route):
+            self.arrive(veh)
+            return
+        veh.pos -= veh.lane.length
+        lanes = self.edges[veh.route[veh.route_index]]
+        veh.lane = lanes[min(veh.lane.index, len(lanes) - 1)]
+
+    def arrive(self, veh):
+        del self.running[veh.id]
+        self.subscriptions.pop(veh.id, None)
+        self.arrived.append(veh.id)
+        if self.tripinfo is not None:
+            # as SUMO: the arrival is the time of the step the vehicle arrives in, the route ends at the lane end
+            arrival = self.time
+            route_length = veh.distance - (veh.pos - veh.lane.length)
+            self.tripinfo.write(
+                f'    <tripinfo id="{veh.id}" depart="{veh.depart:.2f}" departLane="{veh.depart_lane}" '
+                f'departDelay="{veh.depart - veh.desired_depart:.2f}" arrival="{arrival:.2f}" '
+                f'duration="{arrival - veh.depart:.2f}" routeLength="{route_length:.2f}" '
+                f'timeLoss="{veh.time_loss:.2f}" vType="{veh.type_id}" speedFactor="{veh.speed_factor:.2f}"/>\n')
+
+    def lane_is_free(self, lane, pos, veh, lanes):
+        for other in lanes.get(lane.id, []):
+            if other is not veh and pos - veh.length - other.min_gap < other.pos and \
+                    other.pos - other.length - veh.min_gap < pos:
+                return False
+        return True
+
+    def change_lanes(self):
+        lanes = self.lane_vehicles()
+        for veh in list(self.running.values()):
+            if veh.lane_change is None:
+                continue
+            index, until = veh.lane_change
+            if self.time >= until:
+                veh.lane_change = None
+                continue
+            edge_lanes = self.edges[veh.lane.edge]
+            if index == veh.lane.index or not 0 <= index < len(edge_lanes):
+                continue
+            # move one lane at a time towards the target, when there is room
+            target = edge_lanes[veh.lane.index + (1 if index > veh.lane.index else -1)]
+            if self.lane_is_free(target, veh.pos, veh, lanes):
+                lanes[veh.lane.id].remove(veh)
+                lanes.setdefault(target.id, []).append(veh)
+                veh.lane = target
+
+    def insert(self):
+        lanes = self.lane_vehicles()
+        still_pending = []
+        for veh in self.pending:
+            edge_lanes = self.edges[veh.route[0]]
+            depart_lane = veh.flow["departLane"]
+            if depart_lane == "random":
+                lane = self.rng.choice(edge_lanes)
+            elif depart_lane.isdigit():
+                lane = edge_lanes[int(depart_lane)]
+            else:
+                lane = edge_lanes[0]
+            if not self.lane_is_free(lane, veh.length, veh, lanes):
+                still_pending.append(veh)
+                continue
+            depart_speed = veh.flow["departSpeed"]
+            max_speed = lane.speed * veh.speed_factor
+            if depart_speed == "random":
+                veh.speed = self.rng.uniform(0, max_speed)
+            elif depart_speed in ("max", "desired", "speedLimit"):
+                veh.speed = max_speed
+            elif depart_speed.replace(".", "", 1).isdigit():
+                veh.speed = min(float(depart_speed), max_speed)
+            veh.lane, veh.pos, veh.depart, veh.depart_lane = lane, veh.length, self.time, lane.id
+            lanes.setdefault(lane.id, []).append(veh)
+            self.running[veh.id] = veh
+            self.departed.append(veh.id)
+        self.pending = still_pending
+
+    def min_expected_number(self):
+        remaining = 0
+        for flow in self.flows:
+            next_depart = flow["begin"] + flow["count"] * flow["period"]
+            if next_depart < flow["end"]:
+                remaining += int((flow["end"] - next_depart - 1e-9) // flow["period"]) + 1
+        return len(self.running) + len(self.pending) + remaining
+
+    def finish(self):
+        if self.tripinfo is not None:
+            self.tripinfo.write("</tripinfos>\n")
+            self.tripinfo.close()
+            self.tripinfo = None
+
+    def load(self, args):
+        self.finish()
+        self.init(["sumo"] + list(args))
+
+    def close(self, wait=True):
+        self.finish()
+        if _connections.get(self.label) is self:
+            del _connections[self.label]
+
+    def save_state(self, filename):
+        with open(filename, "wb") as f:
+            pickle.dump({field: getattr(self, field) for field in STATE_FIELDS}, f)
+
+    def load_state(self, filename):
+        with open(filename, "rb") as f:
+            self.__dict__.update(pickle.load(f))
+        self.departed, self.arrived = [], []
+        self.subscriptions = {}
+
+    def get(self, vehID):
+        if vehID not in self.running:
+            raise TraCIException(f"Vehicle '{vehID}' is not known.")
+        return self.running[vehID]
+
+
+class VehicleDomain:
+    def __init__(self, sim):
+        self.sim = sim
+
+    def getIDList(self):
+        return tuple(self.sim.running)
+
+    def getIDCount(self):
+        return len(self.sim.running)
+
+    def getTypeID(self, vehID):
+        return self.sim.get(vehID).type_id
+
+    def setType(self, vehID, typeID):
+        self.sim.get(vehID).set_type(typeID, self.sim.vtypes[typeID])
+
+    def getSpeed(self, vehID):
+        return self.sim.get(vehID).speed
+
+    def getLaneID(self, vehID):
+        return self.sim.get(vehID).lane.id
+
+    def getLaneIndex(self, vehID):
+        return self.sim.get(vehID).lane.index
+
+    def getRoadID(self, vehID):
+        return self.sim.get(vehID).lane.edge
+
+    def getLanePosition(self, vehID):
+        return self.sim.get(vehID).pos
+
+    def getLength(self, vehID):
+        return self.sim.get(vehID).length
+
+    def getMinGap(self, vehID):
+        return self.sim.get(vehID).min_gap
+
+    def getDistance(self, vehID):
+        return self.sim.get(vehID).distance
+
+    def getTimeLoss(self, vehID):
+        return self.sim.get(vehID).time_loss
+
+    def getDeparture(self, vehID):
+        return self.sim.get(vehID).depart
+
+    def getDepartDelay(self, vehID):
+        veh = self.sim.get(vehID)
+        return veh.depart - veh.desired_depart
+
+    def getLeader(self, vehID, dist=0.):
+        veh = self.sim.get(vehID)
+        leader = None
+        for other in self.sim.running.values():
+            if other.lane is veh.lane and other.pos > veh.pos and (leader is None or other.pos < leader.pos):
+                leader = other
+        if leader is None:
+            return None
+        return leader.id, leader.pos - leader.length - veh.pos - veh.min_gap
+
+    def changeLane(self, vehID, laneIndex, duration):
+        self.sim.get(vehID).lane_change = (laneIndex, self.sim.time + duration)
+
+    def slowDown(self, vehID, speed, duration):
+        self.sim.get(vehID).slow_down = (speed, self.sim.time + duration)
+
+    def subscribe(self, objectID, varIDs=(constants.VAR_ROAD_ID, constants.VAR_LANEPOSITION), begin=None, end=None):
+        self.sim.get(objectID)
+        self.sim.subscriptions[objectID] = tuple(varIDs)
+
+    def unsubscribe(self, objectID):
+        self.sim.subscriptions.pop(objectID, None)
+
+    def getSubscriptionResults(self, objectID):
+        veh = self.sim.running[objectID]
+        return {var_id: VAR_GETTERS[var_id](veh) for var_id in self.sim.subscriptions.get(objectID, ())}
+
+    def getAllSubscriptionResults(self):
+        return {vehID: self.getSubscriptionResults(vehID) for vehID in self.sim.subscriptions}
+
+
+class SimulationDomain:
+    def __init__(self, sim):
+        self.sim = sim
+
+    def getTime(self):
+        return self.sim.time
+
+    def getDeltaT(self):
+        return DELTA_T
+
+    def getMinExpectedNumber(self):
+        return self.sim.min_expected_number()
+
+    def getDepartedIDList(self):
+        return tuple(self.sim.departed)
+
+    def getArrivedIDList(self):
+        return tuple(self.sim.arrived)
+
+    def getDepartedNumber(self):
+        return len(self.sim.departed)
+
+    def getArrivedNumber(self):
+        return len(self.sim.arrived)
+
+    def saveState(self, fileName):
+        self.sim.save_state(fileName)
+
+    def loadState(self, fileName):
+        self.sim.load_state(fileName)
+
+
+class LaneDomain:
+    def __init__(self, sim):
+        self.sim = sim
+
+    def getIDList(self):
+        return tuple(lane.id for lanes in self.sim.edges.values() for lane in lanes)
+
+    def getLength(self, laneID):
+        for lanes in self.sim.edges.values():
+            for lane in lanes:
+                if lane.id == laneID:
+                    return lane.length
+        raise TraCIException(f"Lane '{laneID}' is not known.")
+
+
+# --- module level API, mirroring the traci module with its labeled connections ---
+
+_connections = {}
+_current = None
+
+
+class _CurrentDomain:
+    def __init__(self, name):
+        self._name = name
+
+    def __getattr__(self, item):
+        return getattr(getattr(getConnection(), self._name), item)
+
+
+vehicle = _CurrentDomain("vehicle")
+simulation = _CurrentDomain("simulation")
+lane = _CurrentDomain("lane")
+
+
+def start(cmd, port=None, numRetries=None, label="default", verbose=False, traceFile=None, traceGetters=True,
+          stdout=None, doSwitch=True):
+    global _current
+    if label in _connections:
+        raise TraCIException(f"Connection '{label}' is already active.")
+    _connections[label] = FakeSimulation(cmd, label)
+    if doSwitch:
+        _current = label
+    return None, None
+
+
+def switch(label):
+    global _current
+    getConnection(label)
+    _current = label
+
+
+def getConnection(label=None):
+    label = _current if label is None else label
+    if label not in _connections:
+        raise FatalTraCIError("Not connected.")
+    return _connections[label]
+
+
+def getLabel():
+    return _current
+
+
+def simulationStep(step=0.):
+    getConnection().simulationStep(step)
+
+
+def load(args):
+    getConnection().load(args)
+
+
+def close(wait=True):
+    global _current
+    getConnection().close(wait)
+    _current = None
@@ -0,0 +1,95 @@
+import os
+import json
+import pickle
+import socket
+import hashlib
+import threading
+import contextlib
+
+try:
+    import fcntl
+except ImportError:  # Windows
+    import msvcrt
+    fcntl = None
+
+
+def tmp_name(path, suffix=".tmp"):
+    # A name next to path that no other host, process or thread uses at the same time: the target may be on a
+    # filesystem shared by several nodes, and the threads of a worker write the same route files.
+    return f"{path}.{socket.gethostname()}.{os.getpid()}.{threading.get_ident()}{suffix}"
+
+
+@contextlib.contextmanager
+def atomic_open(path, mode="w"):
+    # Write to tmp_name(path) and rename, so a crash never leaves a truncated file behind and readers never see a
+    # partial one.
+    tmp_path = tmp_name(path)
+    try:
+        with open(tmp_path, mode) as f:
+            yield f
+        os.replace(tmp_path, path)
+    except BaseException:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        raise
+
+
+def write_json_atomic(path, obj):
+    with atomic_open(path) as f:
+        json.dump(obj, f, indent=1)
+
+
+def write_bytes_atomic(path, data):
+    with atomic_open(path, "wb") as f:
+        f.write(data)
+
+
+def write_pickle_atomic(path, obj):
+    with atomic_open(path, "wb") as f:
+        pickle.dump(obj, f)
+
+
+@contextlib.contextmanager
+def file_lock(path):
+    # an exclusive lock on path, through path.lock, held by one process or thread at a time
+    with open(f"{path}.lock", "a+b") as f:
+        if fcntl is not None:
+            fcntl.flock(f, fcntl.LOCK_EX)
+        else:
+            f.seek(0)
+            while True:
+                try:
+                    msvcrt.locking(f.fileno(), msvcrt.LK_LOCK, 1)
+                    break
+                except OSError:  # still held after LK_LOCK's 10 s of retries
+                    pass
+        try:
+            yield
+        finally:
+            if fcntl is not None:
+                fcntl.flock(f, fcntl.LOCK_UN)
+            else:
+                f.seek(0)
+                msvcrt.locking(f.fileno(), msvcrt.LK_UNLCK, 1)
+
+
+def update_json_locked(path, entries):
+    # Merge entries ({key: value}) into the JSON object at path and return the merged object. The file is re-read
+    # under its lock, so processes updating the same file (e.g. concurrent sweeps in one directory) keep each other's
+    # entries instead of overwriting them with the copy they read at start.
+    with file_lock(path):
+        data = {}
+        if os.path.exists(path):
+            with open(path) as f:
+                data = json.load(f)
+        data.update(entries)
+        write_json_atomic(path, data)
+    return data
+
+
+def file_checksum(path, chunk_size=1 << 20):
+    sha = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(chunk_size), b""):
+            sha.update(chunk)
+    return sha.hexdigest()
@@ -0,0 +1,65 @@
+from bisect import bisect_left
+from itertools import accumulate
+
+
+class LaneIndex:
+    # Vehicles of every lane sorted by lane position, built once per step from a single state snapshot.
+    # states: {vehID: (vType, laneID, lanePos, length, minGap)}
+    def __init__(self, states):
+        by_lane = {}
+        for vehID, (vType, lane, lanePos, length, minGap) in states.items():
+            by_lane.setdefault(lane, []).append((lanePos, vehID, vType, length, minGap))
+        self.lanes = {}
+        self.slots = {}
+        for lane, vehs in by_lane.items():
+            vehs.sort()
+            ids = [veh[1] for veh in vehs]
+            types = [veh[2] for veh in vehs]
+            # dist[i] sums the leader gaps (back of leader - front of follower - follower minGap, as returned by
+            # traci.vehicle.getLeader) from the last vehicle of the lane up to vehicle i
+            dist = [0.0]
+            for (pos, _, _, _, minGap), (leadPos, _, _, leadLength, _) in zip(vehs, vehs[1:]):
+                dist.append(dist[-1] + leadPos - leadLength - pos - minGap)
+            # running maximum keeps the array sorted even if two vehicles overlap (negative gap)
+            reach = list(accumulate(dist, max))
+            self.lanes[lane] = (ids, types, dist, reach)
+            for i, vehID in enumerate(ids):
+                self.slots[vehID] = (lane, i)
+
+    def vehicles_ahead(self, vehID, max_dist=float("inf")):
+        # [(vehID, vType)] of the vehicles ahead on the same lane, nearest first, that a getLeader walk summing the
+        # gaps would visit before the accumulated distance reaches max_dist
+        lane, i = self.slots[vehID]
+        ids, types, dist, reach = self.lanes[lane]
+        end = bisect_left(reach, dist[i] + max_dist, i + 1)
+        return list(zip(ids[i + 1:end], types[i + 1:end]))
+
+    def ahead_of(self, vehIDs, max_dist=float("inf")):
+        # [(laneID, vehID, vType, distance)] of the vehicles ahead of any of vehIDs (themselves excluded) that
+        # vehicles_ahead(source, max_dist) would list for one of them, each once, in a single pass over every lane that
+        # has one. distance is measured from the source behind it for which it is the shortest, as vehicles_ahead
+        # measures it: a vehicle ahead of several sources is within max_dist of one of them iff it is of that one.
+        sources = {}
+        for vehID in vehIDs:
+            lane, i = self.slots[vehID]
+            sources.setdefault(lane, []).append(i)
+        ahead = []
+        for lane, indices in sources.items():
+            ids, types, dist, reach = self.lanes[lane]
+            indices.sort()
+            j, k, origin = indices[0], 0, -float("inf")
+            while j < len(ids):
+                if k < len(indices) and indices[k] == j:
+                    origin = max(origin, dist[j])
+                    j, k = j + 1, k + 1
+                    continue
+                distance = reach[j] - origin
+                if distance >= max_dist:
+                    # nothing further is in range before the next source
+                    if k == len(indices):
+                        break
+                    j = indices[k]
+                    continue
+                ahead.append((lane, ids[j], types[j], distance))
+                j += 1
+        return ahead
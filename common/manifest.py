@@ -0,0 +1,45 @@
+import os
+import json
+import time
+
+from common.files import update_json_locked, file_checksum
+
+
+class RunManifest:
+    # Status of every run of a sweep, kept on disk so an interrupted sweep can be resumed.
+    # Each entry holds the run's parameters (including its seed), its status ("pending", "done" or "failed"),
+    # and for finished runs the output file with its size and sha256 checksum. Every change is merged into the file
+    # as it is on disk, so sweeps sharing the manifest keep each other's entries.
+    def __init__(self, path):
+        self.path = path
+        self.runs = {}
+        if os.path.exists(path):
+            with open(path) as f:
+                self.runs = json.load(f)
+
+    def is_done(self, key, params=None, verify=False):
+        # a run counts as done only if its output is still there, unchanged, and was made with the same params (a
+        # changed duration, seed, route template, ... runs it again)
+        run = self.runs.get(key)
+        if run is None or run["status"] != "done" or not os.path.exists(run["output"]):
+            return False
+        if params is not None and run["params"] != json.loads(json.dumps(params)):
+            return False
+        if os.path.getsize(run["output"]) != run["size"]:
+            return False
+        return not verify or file_checksum(run["output"]) == run["checksum"]
+
+    def mark_pending(self, runs):
+        # runs: {key: params}; runs that never report back stay pending and are retried on the next sweep
+        now = time.time()
+        self.save({key: {"params": params, "status": "pending", "updated": now} for key, params in runs.items()})
+
+    def mark_done(self, key, output, checksum, seconds):
+        self.save({key: dict(self.runs[key], status="done", output=output, size=os.path.getsize(output),
+                             checksum=checksum, seconds=seconds, updated=time.time())})
+
+    def mark_failed(self, key, error):
+        self.save({key: dict(self.runs[key], status="failed", error=error, updated=time.time())})
+
+    def save(self, entries):
+        self.runs = update_json_locked(self.path, entries)
@@ -0,0 +1,144 @@
+import time
+import contextlib
+from collections import defaultdict
+import numpy as np
+
+from common.backend import traci
+from common.files import write_json_atomic
+
+# step time histogram bins, in ms (log spaced: a step takes from tens of microseconds to seconds)
+STEP_MS_BINS = np.logspace(-2, 4, 25)
+# types returned as they are by a profiled backend (constants and exception classes are not timed)
+PLAIN_TYPES = (int, float, str, bytes, tuple, list, dict, type(None))
+
+
+class Phase:
+    # times one phase of the step, e.g. handle_step or simulationStep
+    def __init__(self, profiler, name):
+        self.profiler = profiler
+        self.name = name
+        self.start = None
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+
+    def __exit__(self, exc_type, exc, tb):
+        self.profiler.phase_seconds[self.name] += time.perf_counter() - self.start
+
+
+class ProfiledDomain:
+    # stands in for traci.vehicle, traci.simulation, ...: every method call is timed as "<domain>.<method>"
+    def __init__(self, profiler, name, domain):
+        self._profiler = profiler
+        self._name = name
+        self._domain = domain
+        self._methods = {}
+
+    def __getattr__(self, item):
+        # the domain is fixed, so its methods are wrapped once per name (a bound method is a new object on every
+        # lookup, and would otherwise be wrapped anew on every call)
+        wrapper = self._methods.get(item)
+        if wrapper is None:
+            wrapper = self._profiler.wrap(f"{self._name}.{item}", getattr(self._domain, item), cache=False)
+            if not isinstance(wrapper, PLAIN_TYPES):
+                self._methods[item] = wrapper
+        return wrapper
+
+
+class Profiler:
+    # Opt-in instrumentation of a run: counts the calls and time of every TraCI function the run makes (through
+    # common.backend.traci), times the phases of each step and keeps the step times for a histogram. A disabled
+    # profiler costs one no-op context manager per phase.
+    def __init__(self, enabled=True):
+        self.enabled = enabled
+        self.calls = defaultdict(int)
+        self.call_seconds = defaultdict(float)
+        self.step_calls = defaultdict(int)
+        self.max_step_calls = defaultdict(int)
+        self.phase_seconds = defaultdict(float)
+        self.phases = {}
+        self.wrappers = {}
+        self.step_seconds = []
+        self.last_step_end = None
+        self.start = None
+
+    @contextlib.contextmanager
+    def attached(self):
+        # profile the TraCI calls made inside the block
+        if not self.enabled:
+            yield self
+            return
+        self.start = self.last_step_end = time.perf_counter()
+        traci.profiler = self
+        try:
+            yield self
+        finally:
+            traci.profiler = None
+
+    def phase(self, name):
+        if not self.enabled:
+            return contextlib.nullcontext()
+        if name not in self.phases:
+            self.phases[name] = Phase(self, name)
+        return self.phases[name]
+
+    def end_step(self):
+        if not self.enabled:
+            return
+        now = time.perf_counter()
+        self.step_seconds.append(now - self.last_step_end)
+        self.last_step_end = now
+        for name, n in self.step_calls.items():
+            if n > self.max_step_calls[name]:
+                self.max_step_calls[name] = n
+        self.step_calls.clear()
+
+    def wrap(self, name, attr, cache=True):
+        if isinstance(attr, PLAIN_TYPES) or (isinstance(attr, type) and issubclass(attr, BaseException)):
+            return attr
+        # the backend's attributes are cached by name and by what they belong to: a connection's methods are bound
+        # anew on every lookup, but their connection (and the domains) stay the same for the run
+        key = (name, id(getattr(attr, "__self__", attr)))
+        wrapper = self.wrappers.get(key) if cache else None
+        if wrapper is None:
+            # libsumo's domains are classes, traci's are objects: both are proxied, plain functions are timed
+            if isinstance(attr, type) or not callable(attr):
+                wrapper = ProfiledDomain(self, name, attr)
+            else:
+                wrapper = self.timed(name, attr)
+            if cache:
+                self.wrappers[key] = wrapper
+        return wrapper
+
+    def timed(self, name, func):
+        def call(*args, **kwargs):
+            start = time.perf_counter()
+            try:
+                return func(*args, **kwargs)
+            finally:
+                self.call_seconds[name] += time.perf_counter() - start
+                self.calls[name] += 1
+                self.step_calls[name] += 1
+        return call
+
+    def summary(self):
+        steps = len(self.step_seconds)
+        step_ms = np.array(self.step_seconds) * 1000
+        total = time.perf_counter() - self.start if self.start is not None else 0.
+        counts, edges = np.histogram(step_ms, bins=STEP_MS_BINS)
+        return {
+            "steps": steps,
+            "seconds": total,
+            "phases": {name: {"seconds": seconds, "share": seconds / total if total else 0.}
+                       for name, seconds in self.phase_seconds.items()},
+            "calls": {name: {"calls": n, "seconds": self.call_seconds[name],
+                             "mean_us": self.call_seconds[name] / n * 1e6,
+                             "per_step": n / steps if steps else float(n),
+                             "max_per_step": self.max_step_calls[name]}
+                      for name, n in sorted(self.calls.items(), key=lambda item: -self.call_seconds[item[0]])},
+            "step_ms": {f"p{q}": float(np.percentile(step_ms, q)) for q in (50, 90, 99, 100)} if steps else {},
+            "step_ms_histogram": {"edges": edges.tolist(), "counts": counts.tolist()},
+        }
+
+    def write(self, path):
+        write_json_atomic(path, self.summary())
@@ -0,0 +1,98 @@
+import os
+import queue
+import threading
+import numpy as np
+from PIL import Image, GifImagePlugin
+
+from common.backend import traci
+
+
+class GifWriter:
+    # Encodes every frame into the GIF file as soon as it is appended, so memory holds one frame whatever the length
+    # of the recording (imageio's GIF writer keeps all frames until it is closed). The first frame's palette is the
+    # global color table, later frames carry their own.
+    def __init__(self, path, duration):
+        # duration: display time of a frame, in ms
+        self.file = open(path, "wb")
+        self.duration = duration
+        self.frames = 0
+
+    def append(self, frame):
+        # frame: an RGB(A) or grayscale array
+        image = Image.fromarray(np.ascontiguousarray(frame)).convert("RGB").quantize(
+            method=Image.Quantize.FASTOCTREE)
+        if self.frames == 0:
+            header, _ = GifImagePlugin.getheader(image, info={"loop": 0, "duration": self.duration})
+            self.file.writelines(header)
+        self.file.writelines(GifImagePlugin.getdata(image, duration=self.duration,
+                                                    include_color_table=self.frames > 0))
+        self.frames += 1
+
+    def close(self):
+        if not self.file.closed:
+            self.file.write(b";")  # trailer
+            self.file.close()
+
+
+class GifRecorder:
+    # Streams sumo-gui screenshots into a GIF while the simulation runs. Each screenshot is read, downscaled and
+    # encoded into the file (GifWriter) by a background thread and its PNG is removed right away, so memory and disk
+    # hold at most queue_size frames whatever the recording length. The simulation waits when the writer falls that
+    # far behind.
+    #   every: keep one step out of `every`, scale: keep one pixel out of `scale` in each direction
+    def __init__(self, path, fps=10, every=1, scale=1, view="View #0", frame_dir="frames", queue_size=8):
+        self.every = every
+        self.scale = scale
+        self.view = view
+        self.frame_dir = frame_dir
+        os.makedirs(frame_dir, exist_ok=True)
+        self.queue = queue.Queue(queue_size)
+        self.requested = None
+        self.error = None
+        self.writer = GifWriter(path, 1000 / fps)
+        self.thread = threading.Thread(target=self.write_frames, daemon=True)
+        self.thread.start()
+
+    def capture(self, step):
+        # Call before traci.simulationStep(). sumo-gui saves a screenshot during the step that follows the request,
+        # so the frame requested at the previous call is complete now and can be handed to the writer.
+        self.hand_over()
+        if step % self.every == 0:
+            self.requested = os.path.join(self.frame_dir, f"frame_{step}.png")
+            traci.gui.screenshot(self.view, self.requested)
+
+    def hand_over(self):
+        if self.requested is not None:
+            self.queue.put(self.requested)
+            self.requested = None
+
+    def write_frames(self):
+        while True:
+            image_file = self.queue.get()
+            if image_file is None:
+                return
+            try:
+                if self.error is None:
+                    with Image.open(image_file) as image:
+                        self.writer.append(np.asarray(image)[::self.scale, ::self.scale])
+            except Exception as e:
+                # keep draining the queue so the simulation does not block, the error is raised by close()
+                self.error = e
+            finally:
+                if os.path.exists(image_file):
+                    os.remove(image_file)
+
+    def close(self):
+        # call once the simulation has made its last step (the last requested frame is written by then)
+        self.hand_over()
+        self.queue.put(None)
+        self.thread.join()
+        self.writer.close()
+        if self.error is not None:
+            raise self.error
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.close()
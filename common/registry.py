@@ -0,0 +1,50 @@
+from common.backend import traci
+from common.vehicle_state import subscribe, read_snapshot
+from common.commands import CommandBuffer
+
+
+class VehicleRegistry:
+    # Running vehicles of one simulation, kept up to date from the departed/arrived lists of each step.
+    # A vehicle's type is fetched once on departure and served locally for the rest of its lifetime,
+    # since types never change after insertion (apart from our own set_type).
+    def __init__(self, var_ids=(), extra_var_ids=()):
+        # extra_var_ids are subscribed too, but only reach the raw results of the last snapshot (self.results), not
+        # the snapshot tuples (e.g. the trip metrics, which handle_step does not read)
+        self.var_ids = tuple(var_ids)
+        self.subscribed_var_ids = self.var_ids + tuple(var for var in extra_var_ids if var not in self.var_ids)
+        self.types = {}
+        self.arrived = {}
+        self.results = {}
+        # the controller's commands to the vehicles, sent once per step (see common/commands.py)
+        self.commands = CommandBuffer()
+
+    def update(self):
+        # Call once per step, after traci.simulationStep. Returns the vehicles that departed in that step.
+        # the vehicles that arrived in that step are kept, with their type, in self.arrived until the next update
+        self.arrived = {vehID: self.types.pop(vehID, None) for vehID in traci.simulation.getArrivedIDList()}
+        departed = [vehID for vehID in traci.simulation.getDepartedIDList() if vehID not in self.arrived]
+        for vehID in departed:
+            self.types[vehID] = traci.vehicle.getTypeID(vehID)
+        if self.subscribed_var_ids:
+            subscribe(departed, self.subscribed_var_ids)
+        return departed
+
+    def sync(self):
+        # Rebuild from the running vehicles, after traci.simulation.loadState replaced them (subscriptions are not
+        # part of the saved state)
+        self.types = {vehID: traci.vehicle.getTypeID(vehID) for vehID in traci.vehicle.getIDList()}
+        self.commands = CommandBuffer()
+        if self.subscribed_var_ids:
+            subscribe(self.types, self.subscribed_var_ids)
+
+    def set_type(self, vehID, vType):
+        traci.vehicle.setType(vehID, vType)
+        self.types[vehID] = vType
+
+    def snapshot(self):
+        # {vehID: (vType, value of each var in var_ids)} for every running vehicle
+        if not self.subscribed_var_ids:
+            return {vehID: (vType,) for vehID, vType in self.types.items()}
+        self.results = traci.vehicle.getAllSubscriptionResults()
+        states = read_snapshot(self.var_ids, self.results)
+        return {vehID: (self.types[vehID],) + values for vehID, values in states.items()}
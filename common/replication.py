@@ -0,0 +1,89 @@
+import math
+from statistics import NormalDist, mean, stdev
+
+
+def t_quantile(p, df):
+    # Student's t quantile: exact for 1 and 2 degrees of freedom, Cornish-Fisher expansion of the normal quantile
+    # above (Abramowitz & Stegun 26.7.5, within 1% of the exact value from 3 degrees of freedom on)
+    if df == 1:
+        return math.tan(math.pi * (p - 0.5))
+    if df == 2:
+        return (2 * p - 1) / math.sqrt(2 * p * (1 - p))
+    z = NormalDist().inv_cdf(p)
+    terms = [(z ** 3 + z) / 4,
+             (5 * z ** 5 + 16 * z ** 3 + 3 * z) / 96,
+             (3 * z ** 7 + 19 * z ** 5 + 17 * z ** 3 - 15 * z) / 384,
+             (79 * z ** 9 + 776 * z ** 7 + 1482 * z ** 5 - 1920 * z ** 3 - 945 * z) / 92160]
+    return z + sum(term / df ** (i + 1) for i, term in enumerate(terms))
+
+
+def ci_width(values, confidence=0.95):
+    # width of the t confidence interval of the mean of values (inf below 2 values)
+    if len(values) < 2:
+        return math.inf
+    return 2 * t_quantile(0.5 + confidence / 2, len(values) - 1) * stdev(values) / math.sqrt(len(values))
+
+
+class AdaptiveReplication:
+    # Decides how many replications each cell of a sweep gets, instead of a fixed number for all of them. Every cell
+    # starts with min_reps; after each batch, a cell is done once the confidence interval of the mean of its target
+    # metric is narrower than width, or at max_reps. The sweep spends at most budget replications in total, and each
+    # batch goes to the cells whose interval is the widest relative to width, so what the quiet cells do not use is
+    # spent on the noisy ones.
+    #   cells: hashable keys, e.g. (slow speed, AV probability); a replication is identified by its index in the cell
+    def __init__(self, cells, width, confidence=0.95, batch=5, min_reps=None, max_reps=None, budget=None):
+        self.cells = list(cells)
+        self.width = width
+        self.confidence = confidence
+        self.batch = batch
+        self.min_reps = max(min_reps or batch, 2)
+        self.max_reps = max_reps
+        self.budget = budget
+        self.values = {cell: [] for cell in self.cells}
+        self.launched = {cell: 0 for cell in self.cells}
+
+    def add(self, cell, value):
+        self.values[cell].append(value)
+
+    def ci_width(self, cell):
+        return ci_width(self.values[cell], self.confidence)
+
+    def done(self, cell):
+        n = len(self.values[cell])
+        if self.max_reps is not None and self.launched[cell] >= self.max_reps:
+            return True
+        return n >= self.min_reps and self.ci_width(cell) <= self.width
+
+    def spent(self):
+        return sum(self.launched.values())
+
+    def reps_needed(self, cell):
+        # replications to go until the interval is narrow enough, assuming the spread stays as it is
+        n = len(self.values[cell])
+        if n < self.min_reps:
+            return self.min_reps - n
+        return max(math.ceil(n * (self.ci_width(cell) / self.width) ** 2) - n, 1)
+
+    def next_batch(self):
+        # {cell: replication indices} to run next, empty once every cell is done or the budget is spent. Call again
+        # once the results of the batch are all added.
+        left = math.inf if self.budget is None else self.budget - self.spent()
+        open_cells = [cell for cell in self.cells if not self.done(cell)]
+        # the first batch brings every cell to min_reps, the later ones go to the widest intervals first
+        open_cells.sort(key=lambda cell: (len(self.values[cell]) >= self.min_reps, -self.ci_width(cell) / self.width))
+        batch = {}
+        for cell in open_cells:
+            n = min(self.batch, self.reps_needed(cell), left)
+            if self.max_reps is not None:
+                n = min(n, self.max_reps - self.launched[cell])
+            if n <= 0:
+                continue
+            batch[cell] = list(range(self.launched[cell], self.launched[cell] + n))
+            self.launched[cell] += n
+            left -= n
+        return batch
+
+    def stats(self, cell):
+        values = self.values[cell]
+        return {"mean": mean(values) if values else math.nan, "ci_width": self.ci_width(cell), "reps": len(values),
+                "converged": len(values) >= self.min_reps and self.ci_width(cell) <= self.width}
@@ -0,0 +1,39 @@
+import os
+import json
+from statistics import median
+
+from common.files import update_json_locked
+
+RUN_TIMES_FILE = "run_times.json"
+
+
+class CostModel:
+    # Estimates the wall-clock cost of a simulation task from the recorded runtimes of earlier tasks.
+    # A task is described by its policy, flow (veh/h), AV share and simulated duration (s); without any history the
+    # cost is taken proportional to flow * duration, i.e. to the number of vehicle-steps. Recorded runtimes are merged
+    # into the file as it is on disk, so concurrent sweeps keep each other's.
+    def __init__(self, path=RUN_TIMES_FILE):
+        self.path = path
+        self.runs = {}
+        if os.path.exists(path):
+            with open(path) as f:
+                self.runs = json.load(f)
+
+    def estimate(self, key, policy, flow, av_prob, duration):
+        if key in self.runs:
+            return self.runs[key]["seconds"]
+        # seconds per vehicle-step, from the most similar recorded tasks
+        for similar in [lambda run: run["policy"] == policy and run["av_prob"] == av_prob,
+                        lambda run: run["policy"] == policy,
+                        lambda run: True]:
+            rates = [run["seconds"] / (run["flow"] * run["duration"]) for run in self.runs.values() if similar(run)]
+            if rates:
+                return median(rates) * flow * duration
+        return flow * duration
+
+    def order(self, tasks, key, features):
+        # most expensive first, so the long tasks do not start last and leave the pool idle in the tail
+        return sorted(tasks, key=lambda task: self.estimate(key(task), **features(task)), reverse=True)
+
+    def record(self, key, seconds, **features):
+        self.runs = update_json_locked(self.path, {key: dict(features, seconds=seconds)})
@@ -0,0 +1,16 @@
+from common.backend import traci
+
+
+def subscribe(vehIDs, var_ids):
+    # Subscribe each vehicle once, right after it enters the network. SUMO keeps the subscription for the
+    # vehicle's whole lifetime and drops it on arrival, so the results always cover exactly the running vehicles.
+    for vehID in vehIDs:
+        traci.vehicle.subscribe(vehID, var_ids)
+
+
+def read_snapshot(var_ids, results=None):
+    # State of every subscribed vehicle as {vehID: (value of each var in var_ids)}, without any per-vehicle round trip.
+    # results: the getAllSubscriptionResults() of this step, if the caller already has them
+    if results is None:
+        results = traci.vehicle.getAllSubscriptionResults()
+    return {vehID: tuple(values[var_id] for var_id in var_ids) for vehID, values in results.items()}
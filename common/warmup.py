@@ -0,0 +1,28 @@
+from common.backend import traci
+
+# The runs of the different policies of one configuration are identical until the first step at which a policy
+# acts (the first emergency vehicle, the first merge). That prefix is simulated once and saved, and every policy
+# continues from the saved state. SUMO only restores its random number generators if the state includes them.
+SAVE_STATE_OPTIONS = ["--save-state.rng", "--save-state.precision", "16"]
+
+
+def run_until(diverged, step=0):
+    # Step the simulation until diverged(step) is true at the start of a step, i.e. before handle_step would act on
+    # it, or until the simulation ends. Returns that step, where the policy runs continue.
+    while traci.simulation.getMinExpectedNumber() > 0 and not diverged(step):
+        traci.simulationStep(step)
+        step += 1
+    return step
+
+
+def save_warmup(state_file, diverged):
+    # run the shared prefix on the current connection (started with SAVE_STATE_OPTIONS) and save it
+    fork_step = run_until(diverged)
+    traci.simulation.saveState(state_file)
+    return fork_step
+
+
+def fork_from(state_file, registry):
+    # continue from a saved warm-up on the current connection
+    traci.simulation.loadState(state_file)
+    registry.sync()
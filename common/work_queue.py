@@ -0,0 +1,152 @@
+import os
+import time
+import pickle
+import socket
+import threading
+
+from common.files import write_pickle_atomic
+
+# A task queue in a directory of a filesystem shared by all nodes, for sweeps that need more cores than one machine.
+# The coordinator puts every task in pending/, workers on any node claim one by renaming it into claimed/ (a rename
+# is atomic, so a task is claimed once) and report its results in results/. While a worker runs a task it touches
+# the claimed file every HEARTBEAT_SECONDS; the coordinator puts claims not touched for DEAD_AFTER_SECONDS back in
+# pending/, so the tasks of a dead worker or node are run again. Times are compared on the filesystem's clock, so
+# the nodes' clocks need not agree.
+HEARTBEAT_SECONDS = 30
+DEAD_AFTER_SECONDS = 5 * HEARTBEAT_SECONDS
+POLL_SECONDS = 2
+
+
+def worker_name():
+    return f"{socket.gethostname()}.{os.getpid()}"
+
+
+def read_pickle(path):
+    with open(path, "rb") as f:
+        return pickle.load(f)
+
+
+class Heartbeat:
+    # touches the claimed file of the running task until stopped
+    def __init__(self, path, interval=HEARTBEAT_SECONDS):
+        self.path = path
+        self.interval = interval
+        self.stopped = threading.Event()
+        self.thread = threading.Thread(target=self.beat, daemon=True)
+
+    def beat(self):
+        while not self.stopped.wait(self.interval):
+            try:
+                os.utime(self.path)
+            except FileNotFoundError:
+                # requeued meanwhile: the task runs twice, the coordinator keeps the first results
+                return
+
+    def __enter__(self):
+        self.thread.start()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.stopped.set()
+        self.thread.join()
+
+
+class WorkQueue:
+    def __init__(self, root):
+        self.root = root
+        self.dirs = {state: os.path.join(root, state) for state in ("pending", "claimed", "results")}
+        for path in self.dirs.values():
+            os.makedirs(path, exist_ok=True)
+        self.closed_file = os.path.join(root, "closed")
+
+    # --- coordinator ---
+
+    def put(self, tasks, name):
+        # Queue tasks in the order they should be claimed, name(task) is part of the task file name. Returns the task
+        # file names, by which collect() reports the results. Clears what an earlier sweep left behind.
+        for state in ("pending", "claimed", "results"):
+            for file_name in os.listdir(self.dirs[state]):
+                os.remove(os.path.join(self.dirs[state], file_name))
+        if os.path.exists(self.closed_file):
+            os.remove(self.closed_file)
+        file_names = []
+        for index, task in enumerate(tasks):
+            file_names.append(f"{index:06d}_{name(task)}.pkl")
+            write_pickle_atomic(os.path.join(self.dirs["pending"], file_names[-1]), task)
+        return file_names
+
+    def collect(self):
+        # the results reported since the last call, [(task file name, results)]
+        collected = []
+        for file_name in sorted(os.listdir(self.dirs["results"])):
+            if file_name.endswith(".tmp"):
+                continue
+            path = os.path.join(self.dirs["results"], file_name)
+            collected.append((file_name.split(".result.")[0], read_pickle(path)))
+            os.remove(path)
+        return collected
+
+    def now(self):
+        # the filesystem's time, the clock of the heartbeats
+        clock_file = os.path.join(self.root, "clock")
+        with open(clock_file, "w"):
+            pass
+        os.utime(clock_file)
+        return os.stat(clock_file).st_mtime
+
+    def requeue_stale(self, dead_after=DEAD_AFTER_SECONDS):
+        # put the claims whose worker stopped beating back in pending/, returns their names
+        now = self.now()
+        requeued = []
+        for file_name in os.listdir(self.dirs["claimed"]):
+            path = os.path.join(self.dirs["claimed"], file_name)
+            try:
+                if now - os.stat(path).st_mtime > dead_after:
+                    os.rename(path, os.path.join(self.dirs["pending"], file_name))
+                    requeued.append(file_name)
+            except FileNotFoundError:
+                pass  # completed meanwhile
+        return requeued
+
+    def close(self):
+        # tell the workers to exit once pending/ is empty
+        with open(self.closed_file, "w"):
+            pass
+
+    # --- worker ---
+
+    def claim(self):
+        # (task file name, task) of the first pending task this worker could claim, None if there are none
+        for file_name in sorted(os.listdir(self.dirs["pending"])):
+            if file_name.endswith(".tmp"):
+                continue
+            claimed = os.path.join(self.dirs["claimed"], file_name)
+            try:
+                os.rename(os.path.join(self.dirs["pending"], file_name), claimed)
+                # the rename keeps the mtime of the pending file, the heartbeats start from now
+                os.utime(claimed)
+                return file_name, read_pickle(claimed)
+            except FileNotFoundError:
+                continue  # claimed by another worker, or requeued before the first beat
+        return None
+
+    def complete(self, file_name, results):
+        write_pickle_atomic(os.path.join(self.dirs["results"], f"{file_name}.result.{worker_name()}"), results)
+        try:
+            os.remove(os.path.join(self.dirs["claimed"], file_name))
+        except FileNotFoundError:
+            pass
+
+    def work(self, run_task, heartbeat=HEARTBEAT_SECONDS):
+        # run the tasks of the queue with run_task(task) -> results, until the coordinator closes it
+        while True:
+            claimed = self.claim()
+            if claimed is None:
+                if os.path.exists(self.closed_file):
+                    return
+                time.sleep(POLL_SECONDS)
+                continue
+            file_name, task = claimed
+            with Heartbeat(os.path.join(self.dirs["claimed"], file_name), heartbeat):
+                results = run_task(task)
+            self.complete(file_name, results)